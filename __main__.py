@@ -1,19 +1,19 @@
 import ipaddress as ip
-from src.generate_routes import generateRoutes
-from src.generate_config import platforms
+from src.generate_routes import generateRouteBatches, planRouteGeneration
+from src.mrt import readMRTBatches
+from src.generate_config import platform_writer
 from src.config_validation import validateConfig
-from src.exceptions import ConfigValidationTestFailedError
+from src.exceptions import ConfigValidationTestFailedError, InsufficientAddressSpaceError, MRTFormatError
 from src.read_write_files import read_yaml
+from src.pipeline import runPipeline
 from os import path
 from yaml import safe_load, YAMLError
 import click as cli
 
 @cli.command()
 @cli.option("-c", "--configfile", help="Specify path (including file name) to the config YAML file. By default, routegen assumes a config.yml file in the current working directory", type=str, default="config.yml")
-def main(configfile: str) -> None:
-    routes = []
-    existingPrefixes = []
-
+@cli.option("-w", "--workers", help="Number of worker processes to generate routes (or decode an uncompressed MRT dump) with. By default, routes are generated in a single process", type=cli.IntRange(min=1), default=1)
+def main(configfile: str, workers: int) -> None:
     try:
         config = read_yaml(configfile)
         validateConfig(config=config,
@@ -23,16 +23,20 @@ def main(configfile: str) -> None:
         print(e)
         exit(-1)
 
-    counter = 0
-    while counter < config["prefixes"]["quantity"]:
-        route = generateRoutes()
-        if route.network not in existingPrefixes:
-            routes.append(route)
-            existingPrefixes.append(route.network)
-            counter += 1
-
-    for platform in config["basic"]["platforms"]:
-        platforms[platform](path=path.join(path.dirname(__file__), "output"), routes=routes)
+    # Every platform writer consumes the route batches as they are generated (or read from the MRT dump), instead of waiting for the full table
+    try:
+        if config["basic"]["routeSource"] == "mrt":
+            batches = readMRTBatches(config=config, workers=workers)
+        else:
+            # The configuration is checked against the address space before any writer opens its output file
+            batches = generateRouteBatches(config=config, workers=workers, plan=planRouteGeneration(config=config))
+        runPipeline(
+            batches=batches,
+            writers=[platform_writer(platform=platform, config=config, path=path.join(path.dirname(__file__), "output")) for platform in config["basic"]["platforms"]]
+        )
+    except (ConfigValidationTestFailedError, InsufficientAddressSpaceError, MRTFormatError) as e:
+        print(e)
+        exit(-1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,105 @@
+"""Contains the precomputed table of permitted address intervals that generated networks are sampled from"""
+from ipaddress import IPv4Network, IPv6Network
+from typing import Iterator
+import numpy as np
+from src.constraints import PrefixConstraint
+
+# Special-purpose ranges that are never routable on the internet (0.0.0.0/8 = "this network", 224.0.0.0/4 = multicast, 240.0.0.0/4 = reserved, etc.)
+RESERVED_NETWORKS = [IPv4Network(network) for network in [
+    "0.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8", "169.254.0.0/16", "192.0.0.0/24", "192.0.2.0/24",
+    "198.18.0.0/15", "198.51.100.0/24", "203.0.113.0/24", "224.0.0.0/4", "240.0.0.0/4"
+]]
+
+# RFC 1918 private address space, only permitted when prefixes.includePrivateSpace is set
+PRIVATE_NETWORKS = [IPv4Network(network) for network in ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]]
+
+# The IPv6 global unicast space that networks are generated from, and the special-purpose blocks inside it
+# (2001::/23 = IETF protocol assignments, 2001:db8::/32 and 3fff::/20 = documentation, 2002::/16 = 6to4)
+GLOBAL_UNICAST_NETWORK = IPv6Network("2000::/3")
+RESERVED_IPV6_NETWORKS = [IPv6Network(network) for network in ["2001::/23", "2001:db8::/32", "2002::/16", "3fff::/20"]]
+
+def subtract_intervals(intervals: list[tuple[int, int]], excluded: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Remove the excluded inclusive intervals from the sorted, non-overlapping inclusive intervals"""
+    result = []
+    for start, end in intervals:
+        for excludedStart, excludedEnd in sorted(excluded):
+            if excludedEnd < start or excludedStart > end:
+                continue
+            if excludedStart > start:
+                result.append((start, excludedStart - 1))
+            start = excludedEnd + 1
+            if start > end:
+                break
+        if start <= end:
+            result.append((start, end))
+    return result
+
+def aligned_blocks(intervals: list[tuple[int, int]], bits: int) -> Iterator[tuple[int, int]]:
+    """Decompose inclusive intervals into the largest aligned blocks that cover them, yielded as (network address, prefix length)"""
+    for start, end in intervals:
+        while start <= end:
+            size = start & -start if start else 1 << bits
+            while start + size - 1 > end:
+                size >>= 1
+            yield start, bits + 1 - size.bit_length()
+            start += size
+
+class AddressSpace:
+    """Sorted table of the address intervals that networks may be generated from"""
+    version = 4
+    bits = 32
+    dtype = np.uint32
+    # For every prefix length, the intervals are converted into runs of aligned blocks of that size, so a uniformly drawn
+    # block index picks an interval by its weight and an offset inside it in one step, and no candidate is ever rejected
+    def __init__(self, includePrivateSpace: bool = False, constraint: PrefixConstraint | None = None):
+        excluded = RESERVED_NETWORKS if includePrivateSpace else RESERVED_NETWORKS + PRIVATE_NETWORKS
+        self.intervals = subtract_intervals(
+            intervals=[(0, 2**32 - 1)],
+            excluded=[(int(network.network_address), int(network.broadcast_address)) for network in excluded]
+        )
+        # Folding the prefix constraint into the intervals means generated networks satisfy it without being filtered
+        if constraint:
+            self.intervals = constraint.restrict(self.intervals)
+        self.tables = {}
+
+    def table(self, prefixLength: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the first block number of every interval and the cumulative block count before it for the prefix length"""
+        if prefixLength not in self.tables:
+            hostBits = np.uint64(self.bits - prefixLength)
+            intervals = np.array(self.intervals, dtype=np.uint64).reshape(-1, 2)
+            # Blocks are counted from the first aligned block starting inside an interval up to the last one ending inside it
+            firstBlocks = (intervals[:, 0] + np.uint64((1 << int(hostBits)) - 1)) >> hostBits
+            lastBlocks = (intervals[:, 1] + np.uint64(1)) >> hostBits
+            present = lastBlocks > firstBlocks
+            cumulative = np.concatenate([[0], np.cumsum(lastBlocks[present] - firstBlocks[present])]).astype(np.uint64)
+            self.tables[prefixLength] = (firstBlocks[present], cumulative)
+        return self.tables[prefixLength]
+
+    def capacity(self, prefixLength: int) -> int:
+        """Number of distinct networks of the prefix length that fit inside the permitted address space"""
+        return int(self.table(prefixLength)[1][-1])
+
+    def networks(self, prefixLength: int, indices: np.ndarray) -> np.ndarray:
+        """Map block indices (0 <= index < capacity) onto the network addresses of the corresponding permitted networks"""
+        firstBlocks, cumulative = self.table(prefixLength)
+        indices = indices.astype(np.uint64)
+        interval = np.searchsorted(cumulative, indices, side="right") - 1
+        blocks = firstBlocks[interval] + (indices - cumulative[interval])
+        return (blocks << np.uint64(self.bits - prefixLength)).astype(self.dtype)
+
+class IPv6AddressSpace(AddressSpace):
+    """Sorted table of the IPv6 global unicast intervals that networks may be generated from"""
+    # Intervals are kept over the upper 64 bits of the address (the /64 blocks), so prefixes up to /64 are supported and
+    # every network address is a single uint64 whose lower half is implicitly zero
+    version = 6
+    bits = 64
+    dtype = np.uint64
+
+    def __init__(self, constraint: PrefixConstraint | None = None):
+        self.intervals = subtract_intervals(
+            intervals=[(int(GLOBAL_UNICAST_NETWORK.network_address) >> 64, int(GLOBAL_UNICAST_NETWORK.broadcast_address) >> 64)],
+            excluded=[(int(network.network_address) >> 64, int(network.broadcast_address) >> 64) for network in RESERVED_IPV6_NETWORKS]
+        )
+        if constraint:
+            self.intervals = constraint.restrict(self.intervals)
+        self.tables = {}
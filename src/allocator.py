@@ -0,0 +1,48 @@
+"""Contains the buddy allocator used to carve disjoint (non-overlapping) prefixes out of the permitted address space"""
+from random import Random
+import numpy as np
+from src.address_space import AddressSpace, aligned_blocks
+from src.exceptions import InsufficientAddressSpaceError
+
+class PrefixAllocator:
+    """Buddy allocator handing out disjoint networks from the permitted address space in O(prefix length) per allocation"""
+    def __init__(self, space: AddressSpace, seed: int):
+        self.random = Random(seed)
+        # Free aligned blocks, indexed by prefix length and stored as network address integers
+        self.bits = space.bits
+        self.dtype = space.dtype
+        self.free = [[] for _ in range(space.bits + 1)]
+        for block, length in aligned_blocks(intervals=space.intervals, bits=space.bits):
+            self.free[length].append(block)
+
+    def allocate(self, prefixLength: int) -> int:
+        """Allocate a random free network of the prefix length, splitting the smallest free block that can hold it"""
+        length = prefixLength
+        while not self.free[length]:
+            length -= 1
+            if length < 0:
+                raise InsufficientAddressSpaceError(prefixLength=prefixLength)
+
+        blocks = self.free[length]
+        index = self.random.randrange(len(blocks))
+        blocks[index], blocks[-1] = blocks[-1], blocks[index]
+        block = blocks.pop()
+
+        # Split the block in half until it is the requested size, returning a random half (the buddy) to the free lists
+        while length < prefixLength:
+            length += 1
+            half = 1 << (self.bits - length)
+            if self.random.getrandbits(1):
+                self.free[length].append(block)
+                block += half
+            else:
+                self.free[length].append(block + half)
+        return block
+
+    def allocate_many(self, prefixLengths: np.ndarray) -> np.ndarray:
+        """Allocate a disjoint network for every prefix length in the array, returned in the same order"""
+        networks = np.empty(len(prefixLengths), dtype=self.dtype)
+        # Allocating the largest blocks first guarantees that smaller blocks never fragment space a larger one needed
+        order = np.argsort(prefixLengths, kind="stable")
+        networks[order] = [self.allocate(prefixLength) for prefixLength in prefixLengths[order].tolist()]
+        return networks
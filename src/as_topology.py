@@ -0,0 +1,119 @@
+"""Contains the synthetic AS topology used to derive realistic, shared AS paths for the routes"""
+from random import Random
+from heapq import heappush, heappop
+import numpy as np
+from src.permutation import FeistelPermutation
+from src.sampler import AliasSampler
+
+TIER1_COUNT = 12
+TRANSIT_SHARE = 0.1
+PEERING_DEGREE = 4
+UPSTREAM_COUNTS = [1, 1, 2, 2, 2, 3]
+# Roughly how many prefixes every AS originates in the global table, used to size the graph to the route table
+ROUTES_PER_AS = 16
+# Exponent of the Zipf law deciding how many routes each AS originates
+ORIGIN_EXPONENT = 0.9
+
+class ASTopology:
+    """Tiered AS graph with power-law degrees, where every AS has a cached valley-free path from the local AS"""
+    def __init__(self, size: int, asnBounds: tuple[int, int], seed: int):
+        self.random = Random(seed)
+        self.size = size
+        # Distinct ASNs from a keyed permutation of the allowed range, so no AS appears twice
+        low, high = asnBounds
+        permutation = FeistelPermutation(size=high - low + 1, key=self.random.getrandbits(64))
+        self.asns = (np.uint64(low) + permutation.permute(np.arange(size, dtype=np.uint64))).astype(np.uint32)
+
+        self.providers = [[] for _ in range(size + 1)]
+        self.customers = [[] for _ in range(size + 1)]
+        self.peers = [[] for _ in range(size + 1)]
+        self.build()
+        self.paths()
+
+        # A few ASes originate most of the table, the long tail originates a handful of routes each
+        ranks = np.array(self.random.sample(range(size), size), dtype=np.float64)
+        self.origins = AliasSampler(values=list(range(size)), weights=(1 / (ranks + 1) ** ORIGIN_EXPONENT).tolist())
+
+    @classmethod
+    def for_routes(cls, quantity: int, asnBounds: tuple[int, int], seed: int) -> "ASTopology":
+        """Build a graph with about as many ASes as the global table has for the requested number of routes"""
+        return cls(size=min(max(quantity // ROUTES_PER_AS, 2 * TIER1_COUNT), 65536, asnBounds[1] - asnBounds[0] + 1), asnBounds=asnBounds, seed=seed)
+
+    def link(self, customer: int, provider: int):
+        """Add a customer-to-provider relationship"""
+        self.providers[customer].append(provider)
+        self.customers[provider].append(customer)
+
+    def build(self):
+        """Attach every AS to providers in the tiers above it by preferential attachment, giving power-law degrees"""
+        tier1 = min(TIER1_COUNT, self.size)
+        transit = tier1 + int((self.size - tier1) * TRANSIT_SHARE)
+        for node in range(tier1):
+            self.peers[node] = [peer for peer in range(tier1) if peer != node]
+
+        # Every provider appears once per customer (plus once for itself), so a uniform pick is proportional to its degree.
+        # Providers are always added before their customers, which keeps the customer-to-provider graph acyclic
+        attachment = list(range(tier1))
+        for node in list(range(tier1, self.size)) + [self.size]:
+            providers = set()
+            count = min(self.random.choice(UPSTREAM_COUNTS), node, transit)
+            while len(providers) < count:
+                providers.add(self.random.choice(attachment))
+            for provider in sorted(providers):
+                self.link(customer=node, provider=provider)
+                attachment.append(provider)
+            if node < transit:
+                attachment.append(node)
+
+        # Transit ASes peer with a few others at random
+        for node in range(tier1, transit):
+            for _ in range(PEERING_DEGREE // 2):
+                peer = self.random.randrange(tier1, transit)
+                if peer != node and peer not in self.peers[node] and peer not in self.providers[node] and peer not in self.customers[node]:
+                    self.peers[node].append(peer)
+                    self.peers[peer].append(node)
+
+    def paths(self):
+        """Find the shortest valley-free path from the local AS (the last node) to every AS, and store them in one ASN pool"""
+        local = self.size
+        # States are (node, descending): uphill over providers first, then at most one peer link, then downhill over customers
+        distance = {(local, False): 0}
+        parent = {}
+        queue = [(0, local, False)]
+        while queue:
+            hops, node, descending = heappop(queue)
+            if hops > distance[(node, descending)]:
+                continue
+            steps = [(customer, True) for customer in self.customers[node]]
+            if not descending:
+                steps += [(provider, False) for provider in self.providers[node]] + [(peer, True) for peer in self.peers[node]]
+            for step in steps:
+                if hops + 1 < distance.get(step, hops + 2):
+                    distance[step] = hops + 1
+                    parent[step] = (node, descending)
+                    heappush(queue, (hops + 1, *step))
+
+        pool, offsets, lengths = [], [], []
+        for node in range(self.size):
+            state = min(((node, descending) for descending in (False, True) if (node, descending) in distance), key=distance.get)
+            path = []
+            while state[0] != local:
+                path.append(int(self.asns[state[0]]))
+                state = parent[state]
+            offsets.append(len(pool))
+            lengths.append(len(path))
+            # The AS_PATH lists the neighbor of the local AS first and the origin AS last
+            pool.extend(reversed(path))
+
+        self.pathPool = np.array(pool, dtype=np.uint32)
+        self.pathOffset = np.array(offsets, dtype=np.uint32)
+        self.pathLength = np.array(lengths, dtype=np.uint8)
+
+    def __getstate__(self) -> dict:
+        """Only ship the cached paths and the origin sampler to worker processes, not the graph they were derived from"""
+        return {key: value for key, value in self.__dict__.items() if key not in ("random", "providers", "customers", "peers")}
+
+    def aspaths(self, uniforms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Pick an origin AS for every uniform number in [0, 1), returning the offsets and lengths of their cached paths in the pool"""
+        origins = self.origins.indices(uniforms)
+        return self.pathOffset[origins], self.pathLength[origins]
@@ -0,0 +1,35 @@
+"""Contains the capacity planner, which checks that the permitted address space can hold every requested network before generation starts"""
+from src.address_space import AddressSpace, aligned_blocks
+from src.exceptions import InsufficientAddressSpaceError
+
+def overlapping_shortfall(quotas: dict[int, int], space: AddressSpace) -> tuple[int, int, int] | None:
+    """Return the first prefix length (with its requested and available counts) that has more networks requested than fit, when networks may overlap"""
+    for prefixLength, count in quotas.items():
+        if count > space.capacity(prefixLength):
+            return prefixLength, count, space.capacity(prefixLength)
+    return None
+
+def disjoint_shortfall(quotas: dict[int, int], space: AddressSpace) -> tuple[int, int, int] | None:
+    """Return the first prefix length (with its requested and available counts) that the buddy allocator cannot fit, when networks must be disjoint"""
+    # The allocator hands out the largest networks first, so it never fragments space a larger network needed, and it succeeds
+    # exactly when every prefix length passes a Kraft-style count: the networks requested up to that length, measured in blocks
+    # of that length, must not outnumber the blocks of that length inside the free blocks of the permitted space
+    freeBlocks = {}
+    for _, length in aligned_blocks(intervals=space.intervals, bits=space.bits):
+        freeBlocks[length] = freeBlocks.get(length, 0) + 1
+    for prefixLength in sorted(quotas):
+        available = sum(count << (prefixLength - length) for length, count in freeBlocks.items() if length <= prefixLength)
+        requested = sum(count << (prefixLength - length) for length, count in quotas.items() if length <= prefixLength)
+        if requested > available:
+            # Report what remains for this prefix length once the larger networks have been carved out
+            larger = requested - quotas[prefixLength]
+            return prefixLength, quotas[prefixLength], max(available - larger, 0)
+    return None
+
+def plan_capacity(quotas: dict[int, dict[int, int]], spaces: dict[int, AddressSpace], allowOverlap: bool = True):
+    """Check the prefix length quotas of every address family against its permitted address space, raising before any route is generated if they cannot be met"""
+    for family, familyQuotas in quotas.items():
+        shortfall = (overlapping_shortfall if allowOverlap else disjoint_shortfall)(quotas=familyQuotas, space=spaces[family])
+        if shortfall:
+            prefixLength, requested, available = shortfall
+            raise InsufficientAddressSpaceError(prefixLength=prefixLength, requested=requested, available=available)
@@ -0,0 +1,268 @@
+"""Contains the compiled policy constraints, which accept or reject whole batches of routes with vectorized lookups"""
+from ipaddress import ip_network, IPv4Network, IPv6Network
+from typing import Any
+import numpy as np
+from src.objects import RouteTable
+from src.sampler import AliasSampler
+
+def block_ends(first: np.ndarray, hostBits: np.ndarray) -> np.ndarray:
+    """Return the last address of every block, given its first address and its number of host bits (up to 64)"""
+    hostBits = hostBits.astype(np.uint64)
+    # Shifting 2 by (hostBits - 1) instead of 1 by hostBits keeps 64 host bits within the width of a uint64
+    return first | np.where(hostBits > 0, (np.uint64(2) << (np.maximum(hostBits, np.uint64(1)) - np.uint64(1))) - np.uint64(1), np.uint64(0))
+
+class PrefixConstraint:
+    """Include or exclude list of prefixes, compiled into merged and sorted arrays of inclusive address intervals"""
+    # IPv6 prefixes are compiled over the upper 64 bits of the address, matching the IPv6 address space and route tables
+    def __init__(self, action: str, networks: list[IPv4Network | IPv6Network], version: int = 4):
+        self.action = action
+        self.version = version
+        self.bits = 32 if version == 4 else 64
+        shift = 64 if version == 6 else 0
+        intervals = np.array(sorted((int(network.network_address) >> shift, int(network.broadcast_address) >> shift) for network in networks), dtype=np.uint64).reshape(-1, 2)
+
+        # An interval starts a new merged run unless it overlaps or touches the furthest end seen before it
+        starts, ends = intervals[:, 0], np.maximum.accumulate(intervals[:, 1]) if len(intervals) else intervals[:, 1]
+        first = np.ones(len(starts), dtype=bool)
+        first[1:] = (starts[1:] > ends[:-1]) & (starts[1:] - ends[:-1] > np.uint64(1))
+        self.starts = starts[first]
+        self.ends = ends[np.append(np.flatnonzero(first)[1:] - 1, len(ends) - 1)] if len(starts) else ends
+
+    @classmethod
+    def from_config(cls, constraint: dict[str, Any] | None, version: int) -> "PrefixConstraint | None":
+        """Compile the policy.constraints.prefix configuration for one address family, if it lists any prefixes of that family"""
+        if not constraint:
+            return None
+        networks = [network for network in (ip_network(item["value"]) for item in constraint.get("values", [])) if network.version == version]
+        return cls(action=constraint["action"], networks=networks, version=version) if networks else None
+
+    def allowed(self) -> list[tuple[int, int]]:
+        """Return the intervals that networks may be taken from, as inclusive (start, end) pairs"""
+        if self.action == "include":
+            return list(zip(self.starts.tolist(), self.ends.tolist()))
+        # The gaps between the excluded intervals
+        gaps, start = [], 0
+        for excludedStart, excludedEnd in zip(self.starts.tolist(), self.ends.tolist()):
+            if excludedStart > start:
+                gaps.append((start, excludedStart - 1))
+            start = excludedEnd + 1
+        if start <= 2**self.bits - 1:
+            gaps.append((start, 2**self.bits - 1))
+        return gaps
+
+    def restrict(self, intervals: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """Intersect sorted, non-overlapping inclusive intervals with the intervals the constraint allows"""
+        allowed = np.array(self.allowed(), dtype=np.uint64).reshape(-1, 2)
+        result = []
+        for start, end in intervals:
+            # Only the allowed intervals between the first one ending after start and the last one starting before end overlap
+            low, high = np.searchsorted(allowed[:, 1], start, side="left"), np.searchsorted(allowed[:, 0], end, side="right")
+            result += zip(np.maximum(allowed[low:high, 0], np.uint64(start)).tolist(), np.minimum(allowed[low:high, 1], np.uint64(end)).tolist())
+        return result
+
+    def mask(self, table: RouteTable) -> np.ndarray:
+        """Return True for every route of the table that the constraint accepts, with one binary search per route"""
+        first = table.network.astype(np.uint64) if table.version == 4 else table.network[:, 0]
+        last = block_ends(first, self.bits - np.minimum(table.prefixLength.astype(np.int64), self.bits))
+        if not len(self.starts):
+            return np.full(len(table), self.action == "exclude")
+        if self.action == "include":
+            # The network must lie inside the last interval starting at or before it
+            index = np.searchsorted(self.starts, first, side="right") - 1
+            return (index >= 0) & (last <= self.ends[np.maximum(index, 0)])
+        # The network must not reach the first interval ending at or after its start
+        index = np.searchsorted(self.ends, first, side="left")
+        return ~((index < len(self.starts)) & (self.starts[np.minimum(index, len(self.starts) - 1)] <= last))
+
+def parse_asn(value: str | int) -> int:
+    """Parse an ASN in plain (asplain) or dotted (asdot) notation"""
+    high, _, low = str(value).partition(".")
+    return (int(high) << 16) + int(low) if low else int(high)
+
+def window_starts(offsets: np.ndarray, lengths: np.ndarray, width: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """Return the route and pool position of every window of the given width that lies inside a single route's run in the pool"""
+    counts = np.maximum(lengths.astype(np.int64) - (width - 1), 0)
+    positions = np.repeat(offsets.astype(np.int64), counts) + np.arange(int(counts.sum())) - np.repeat(RouteTable.offsets(counts).astype(np.int64), counts)
+    return np.repeat(np.arange(len(counts)), counts), positions
+
+def route_hits(offsets: np.ndarray, lengths: np.ndarray, hits: np.ndarray, width: int = 1) -> np.ndarray:
+    """Return True for every route with a hit at any position of its run in the pool where a window of the given width fits"""
+    routes, positions = window_starts(offsets, lengths, width)
+    return np.bincount(routes, weights=hits[positions], minlength=len(lengths)) > 0
+
+def redraw_asns(excluded: np.ndarray, bounds: np.ndarray, uniforms: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """Draw ASNs uniformly from the inclusive bounds of every row without the sorted excluded ASNs, keeping the current ASN where every ASN is excluded"""
+    low, high = bounds[:, 0].astype(np.int64), bounds[:, 1].astype(np.int64)
+    below = np.searchsorted(excluded, low)
+    count = high - low + 1 - (np.searchsorted(excluded, high, side="right") - below)
+    rank = np.minimum((uniforms * count).astype(np.int64), np.maximum(count - 1, 0))
+    # The rank-th allowed ASN is offset by the number of excluded ASNs at or below it, found by searching the excluded ASNs less their own ranks
+    skipped = np.searchsorted(excluded - np.arange(len(excluded)), rank + low - below, side="right") - below
+    return np.where(count > 0, low + rank + skipped, current).astype(np.uint32)
+
+class ASPathConstraint:
+    """Origin and transit AS constraints, compiled into a sorted array of origin ASNs and a ragged array of transit sequences"""
+    def __init__(self, action: str, origins: list[int], originWeights: list[int], transits: list[list[int]], transitWeights: list[int]):
+        self.action = action
+        self.origins = np.unique(np.array(origins, dtype=np.uint32))
+        self.originSampler = AliasSampler(values=origins, weights=originWeights) if origins else None
+        self.transits = [np.array(transit, dtype=np.uint32) for transit in transits]
+        # For exclusion, a rewritten ASN is redrawn outside every excluded origin and transit ASN, so it can never complete a new excluded match
+        self.excluded = np.unique(np.concatenate([self.origins.astype(np.int64)] + [transit.astype(np.int64) for transit in self.transits]))
+        self.transitSampler = AliasSampler(values=list(range(len(transits))), weights=transitWeights) if transits else None
+
+    @classmethod
+    def from_config(cls, constraint: dict[str, Any] | None) -> "ASPathConstraint | None":
+        """Compile the policy.constraints.bgp_aspath configuration, if it lists any origins or transit sequences"""
+        if not constraint:
+            return None
+        values = constraint.get("values") or {}
+        origins, transits = values.get("origin") or [], values.get("transit") or []
+        if not origins and not transits:
+            return None
+        return cls(
+            action=constraint["action"],
+            origins=[parse_asn(item["value"]) for item in origins], originWeights=[item["probability"] for item in origins],
+            transits=[[parse_asn(asn) for asn in str(item["value"]).split()] for item in transits], transitWeights=[item["probability"] for item in transits]
+        )
+
+    def origin_hits(self, offsets: np.ndarray, lengths: np.ndarray, pool: np.ndarray) -> np.ndarray:
+        """Return True for every path whose origin (last) ASN is one of the constraint's origins"""
+        if not len(self.origins) or not len(pool):
+            return np.zeros(len(offsets), dtype=bool)
+        origins = pool[np.maximum(offsets.astype(np.int64) + lengths - 1, 0)]
+        index = np.minimum(np.searchsorted(self.origins, origins), len(self.origins) - 1)
+        return (lengths > 0) & (self.origins[index] == origins)
+
+    def transit_hits(self, offsets: np.ndarray, lengths: np.ndarray, pool: np.ndarray) -> np.ndarray:
+        """Return True for every path that contains any of the constraint's transit sequences"""
+        hits = np.zeros(len(offsets), dtype=bool)
+        for transit in self.transits:
+            if len(pool) >= len(transit):
+                # Compare every window of the pool against the sequence at once, then keep the windows lying inside a single path
+                windows = (np.lib.stride_tricks.sliding_window_view(pool, len(transit)) == transit).all(axis=1)
+                hits |= route_hits(offsets, lengths, windows, width=len(transit))
+        return hits
+
+    def mask(self, table: RouteTable) -> np.ndarray:
+        """Return True for every route of the table whose AS path satisfies the constraint"""
+        origins = self.origin_hits(table.aspathOffset, table.aspathLength, table.asnPool)
+        transits = self.transit_hits(table.aspathOffset, table.aspathLength, table.asnPool)
+        if self.action == "include":
+            return (origins | (not len(self.origins))) & (transits | (not self.transits))
+        return ~origins & ~transits
+
+    def steer(self, lengths: np.ndarray, pool: np.ndarray, bounds: np.ndarray, originUniforms: np.ndarray, transitUniforms: np.ndarray, redrawUniforms: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Rewrite consecutive generated paths so they satisfy the constraint, returning the new path lengths and pool"""
+        # Bounds holds the inclusive ASN bounds of every path, and redrawUniforms (needed for exclusion) one uniform for every ASN of the pool
+        lengths = lengths.astype(np.int64)
+        if self.action == "include" and self.transitSampler:
+            # Insert a chosen transit sequence in front of the origin of every path (paths that would outgrow 255 ASNs are left alone)
+            chosen = self.transitSampler.sample(transitUniforms)
+            sequenceLengths = np.array([len(transit) for transit in self.transits], dtype=np.int64)[chosen]
+            sequenceLengths[lengths + sequenceLengths > 255] = 0
+            sequencePool = np.concatenate(self.transits)
+            sequenceOffsets = RouteTable.offsets(np.array([len(transit) for transit in self.transits])).astype(np.int64)[chosen]
+
+            newLengths = lengths + sequenceLengths
+            route = np.repeat(np.arange(len(lengths)), newLengths)
+            position = np.arange(int(newLengths.sum())) - np.repeat(RouteTable.offsets(newLengths).astype(np.int64), newLengths)
+            offsets, head = RouteTable.offsets(lengths).astype(np.int64)[route], np.maximum(lengths - 1, 0)[route]
+            inSequence = (position >= head) & (position < head + sequenceLengths[route])
+            source = np.where(position < head, position, position - sequenceLengths[route])
+            fromSequence = sequencePool[np.clip(sequenceOffsets[route] + position - head, 0, len(sequencePool) - 1)]
+            fromPath = pool[np.clip(offsets + source, 0, len(pool) - 1)] if len(pool) else np.zeros(len(position), dtype=np.uint32)
+            pool = np.where(inSequence, fromSequence, fromPath).astype(np.uint32)
+            lengths = newLengths
+
+        offsets = RouteTable.offsets(lengths).astype(np.int64)
+        last = offsets + lengths - 1
+        if self.action == "include" and self.originSampler:
+            pool[last[lengths > 0]] = self.originSampler.sample(originUniforms)[lengths > 0]
+        elif self.action == "exclude":
+            excluded = self.origin_hits(offsets, lengths, pool)
+            pool[last[excluded]] = redraw_asns(self.excluded, bounds[excluded], redrawUniforms[last[excluded]], pool[last[excluded]])
+            # Break up every occurrence of an excluded transit sequence inside a single path by redrawing its first ASN
+            for transit in self.transits:
+                if len(pool) >= len(transit):
+                    windows = (np.lib.stride_tricks.sliding_window_view(pool, len(transit)) == transit).all(axis=1)
+                    routes, positions = window_starts(offsets, lengths, width=len(transit))
+                    hit = windows[positions]
+                    routes, positions = routes[hit], positions[hit]
+                    pool[positions] = redraw_asns(self.excluded, bounds[routes], redrawUniforms[positions], pool[positions])
+        return lengths.astype(np.uint8), pool
+
+class CommunityConstraint:
+    """Community patterns, compiled into mask/value pairs (a wildcard clears its part of the mask) and ranges of packed standard communities"""
+    def __init__(self, action: str, patterns: list[str], weights: list[int]):
+        self.action = action
+        self.patterns = [str(pattern) for pattern in patterns]
+        standard, ranges, large = [], [], []
+        for index, pattern in enumerate(self.patterns):
+            parts = pattern.split(":")
+            if len(parts) == 1:
+                low, _, high = pattern.partition("-")
+                ranges.append((index, int(low), int(high or low)))
+            elif len(parts) == 2:
+                standard.append((index, sum(0 if part == "*" else 0xFFFF << shift for part, shift in zip(parts, (16, 0))),
+                                 sum(0 if part == "*" else int(part) << shift for part, shift in zip(parts, (16, 0)))))
+            else:
+                large.append((index, [0 if part == "*" else 0xFFFFFFFF for part in parts], [0 if part == "*" else int(part) for part in parts]))
+        self.kinds = np.zeros(len(self.patterns), dtype=np.uint8)
+        self.standardIndex = np.array([item[0] for item in standard], dtype=np.int64)
+        self.standardMasks = np.array([item[1] for item in standard], dtype=np.uint32)
+        self.standardValues = np.array([item[2] for item in standard], dtype=np.uint32)
+        self.rangeIndex = np.array([item[0] for item in ranges], dtype=np.int64)
+        self.rangeLows = np.array([item[1] for item in ranges], dtype=np.uint32)
+        self.rangeHighs = np.array([item[2] for item in ranges], dtype=np.uint32)
+        self.largeIndex = np.array([item[0] for item in large], dtype=np.int64)
+        self.largeMasks = np.array([item[1] for item in large], dtype=np.uint32).reshape(-1, 3)
+        self.largeValues = np.array([item[2] for item in large], dtype=np.uint32).reshape(-1, 3)
+        self.kinds[self.largeIndex] = 1
+        self.sampler = AliasSampler(values=list(range(len(self.patterns))), weights=weights)
+
+    @classmethod
+    def from_config(cls, constraint: dict[str, Any] | None) -> "CommunityConstraint | None":
+        """Compile the policy.constraints.bgp_communities configuration, if it lists any patterns"""
+        if not constraint or not constraint.get("values"):
+            return None
+        return cls(action=constraint["action"], patterns=[item["value"] for item in constraint["values"]], weights=[item["probability"] for item in constraint["values"]])
+
+    def standard_hits(self, communities: np.ndarray) -> np.ndarray:
+        """Return True for every packed standard community matching any standard pattern or range"""
+        communities = communities[:, None]
+        return (((communities & self.standardMasks) == self.standardValues).any(axis=1)
+                | ((communities >= self.rangeLows) & (communities <= self.rangeHighs)).any(axis=1))
+
+    def large_hits(self, communities: np.ndarray) -> np.ndarray:
+        """Return True for every large community (row of three) matching any large pattern"""
+        return ((communities[:, None, :] & self.largeMasks) == self.largeValues).all(axis=2).any(axis=1)
+
+    def mask(self, table: RouteTable) -> np.ndarray:
+        """Return True for every route of the table whose communities satisfy the constraint"""
+        hits = (route_hits(table.communityOffset, table.communityLength, self.standard_hits(table.communityPool))
+                | route_hits(table.largeCommunityOffset, table.largeCommunityLength, self.large_hits(table.largeCommunityPool)))
+        return hits if self.action == "include" else ~hits
+
+    def draw(self, uniforms: np.ndarray, bits: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Draw one community matching a pattern for every uniform number, filling wildcards and ranges from 64 random bits each.
+        Returns whether each one is large, the packed standard communities and the large communities"""
+        chosen = self.sampler.indices(uniforms)
+        standard = np.zeros(len(chosen), dtype=np.uint32)
+        large = np.zeros((len(chosen), 3), dtype=np.uint32)
+        low32, high32 = (bits & np.uint64(0xFFFFFFFF)).astype(np.uint32), (bits >> np.uint64(32)).astype(np.uint32)
+
+        selected = np.isin(chosen, self.standardIndex)
+        pattern = np.searchsorted(self.standardIndex, chosen[selected])
+        standard[selected] = (low32[selected] & ~self.standardMasks[pattern]) | self.standardValues[pattern]
+        selected = np.isin(chosen, self.rangeIndex)
+        pattern = np.searchsorted(self.rangeIndex, chosen[selected])
+        span = self.rangeHighs[pattern].astype(np.uint64) - self.rangeLows[pattern] + np.uint64(1)
+        standard[selected] = (self.rangeLows[pattern] + bits[selected] % span).astype(np.uint32)
+        selected = np.isin(chosen, self.largeIndex)
+        pattern = np.searchsorted(self.largeIndex, chosen[selected])
+        randomParts = np.stack([high32[selected], low32[selected], high32[selected] ^ low32[selected]], axis=1)
+        large[selected] = (randomParts & ~self.largeMasks[pattern]) | self.largeValues[pattern]
+        # Zero pads interned community sets, so a fully wildcarded draw of zero is nudged to the smallest value
+        standard[standard == 0] = 1
+        return self.kinds[chosen].astype(bool), standard, large
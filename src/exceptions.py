@@ -4,4 +4,27 @@ class ConfigValidationTestFailedError(Exception):
     def __init__(self, test: str) -> None:
         self.test = test
     def __str__(self) -> str:
-        return f"Test failed during configuration validation: {self.test}"
\ No newline at end of file
+        return f"Test failed during configuration validation: {self.test}"
+
+class InsufficientAddressSpaceError(Exception):
+    """Exception raised when the permitted address space cannot hold the requested prefixes"""
+    def __init__(self, prefixLength: int, requested: int | None = None, available: int | None = None) -> None:
+        self.prefixLength = prefixLength
+        self.requested = requested
+        self.available = available
+    def __str__(self) -> str:
+        counts = f" ({self.requested} requested, {self.available} available)" if self.requested is not None else ""
+        return f"Not enough permitted address space is available for the requested /{self.prefixLength} prefixes{counts}"
+
+class MRTFormatError(Exception):
+    """Exception raised when an MRT dump cannot be decoded"""
+    def __init__(self, path: str, reason: str) -> None:
+        self.path = path
+        self.reason = reason
+    def __str__(self) -> str:
+        return f"Could not read the MRT dump at {self.path}: {self.reason}"
+
+class PipelineAbortedError(Exception):
+    """Exception raised inside a platform writer when the route batches it consumes stop early because their producer failed"""
+    def __str__(self) -> str:
+        return "Route generation stopped before the end of the route table"
\ No newline at end of file
@@ -1,85 +1,126 @@
 """Contains all functions required to generate configuration for network devices/the routebox container"""
-from src.objects import Route, Neighbor
+from src.objects import Route, RouteTable, Neighbor, format_community, format_large_community
 from src.build_container import buildContainer
 from jinja2 import Environment, FileSystemLoader
 from ipaddress import IPv4Address
 from hashlib import sha256
-from collections import defaultdict
+from shutil import copyfile
 from datetime import datetime
+from contextlib import contextmanager, suppress
+from functools import partial
+from os import getpid, path as osPath, remove, replace
+from typing import Any, Callable, Iterable, Iterator, TextIO
 
-def writeConfig(path: str, config: str, fileName: str = "config.txt") -> None:
-    """Simple function to export the generated configuration to a text file on disk"""
-    with open(f"{path}/{fileName}", "w") as file:
-        file.write(config)
+# The container's templates, which its image is also built from, ship in the container directory at the root of the package
+CONTAINER_TEMPLATES = osPath.join(osPath.dirname(osPath.dirname(osPath.abspath(__file__))), "container")
 
-def config_ios(routes: list[Route], path: str, localAS: int = None, vrf: str = "") -> None:
+@contextmanager
+def atomic_file(fileName: str) -> Iterator[TextIO]:
+    """Open a temporary file for writing, renaming it to the given name if the block completes and removing it otherwise"""
+    temporary = f"{fileName}.{getpid()}.tmp"
+    try:
+        with open(temporary, "w") as file:
+            yield file
+        replace(temporary, fileName)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            remove(temporary)
+        raise
+
+def writeConfig(path: str, config: Iterable[str], fileName: str = "config.txt") -> None:
+    """Simple function to export the generated configuration to a text file on disk, writing each line as soon as it is produced"""
+    # The lines go to a temporary file that only replaces the configuration once all of them are written
+    with atomic_file(f"{path}/{fileName}") as file:
+        for line in config:
+            file.write(f"{line}\n")
+
+def config_ios(batches: Iterable[RouteTable], path: str, localAS: int = None, vrf: str = "") -> None:
     """Generate route/policy configurations for Cisco IOS and IOS-XE platforms"""
-    config = []
-    baseRouteCommand = f"ip route vrf {vrf}" if vrf else "ip route"
-    for route in routes:
-        config.append(f"{baseRouteCommand} {" ".join(str(route.network.with_netmask).split("/"))} null0")
-    
-    # Identify routes with identical policy configurations
-    routeDict = defaultdict(list)
-    for route in routes:
-        routeDict[(" ".join(route.aspath), " ".join(route.communities), route.origin)].append(route.network)
-    
-    for index, value in enumerate(routeDict):
-        prefixListName = f"ROUTEGEN-PL{index + 1}"
-
-        for prefixIndex, prefixValue in enumerate(routeDict[value]):
-            config.append(f"ip prefix-list {prefixListName} seq {(prefixIndex + 1)} permit {prefixValue}")
-        
-        config.append(f"route-map ROUTEGEN-RM permit {(index + 1)}")
-        config.append(f"  match ip address prefix-list {prefixListName}")
-        config.append(f"  set as-path prepend {value[0]}" if value[0] else "")
-        config.append(f"  set community add {value[1]}" if value[1] else "")
-        config.append(f"  set origin {value[2]}" if value[2] != "igp" else "")
+    def config() -> Iterator[str]:
+        baseRouteCommand = f"ip route vrf {vrf}" if vrf else "ip route"
+        baseIPv6RouteCommand = f"ipv6 route vrf {vrf}" if vrf else "ipv6 route"
+        # Identify routes with identical policy configurations, only keeping the prefix-list number and sequence of each one
+        routeDict = {}
+        for batch in batches:
+            for route in batch:
+                if route.network.version == 4:
+                    yield f"{baseRouteCommand} {" ".join(str(route.network.with_netmask).split("/"))} null0"
+                else:
+                    yield f"{baseIPv6RouteCommand} {route.network} null0"
+
+                # Routes carry interned attribute tuples, so grouping hashes integers and text is only built once per group
+                policy = routeDict.setdefault((route.network.version, route.aspath, route.communities, route.largeCommunities, route.origin), [len(routeDict) + 1, 0])
+                policy[1] += 1
+                yield f"{"ip" if route.network.version == 4 else "ipv6"} prefix-list ROUTEGEN-PL{policy[0]} seq {policy[1]} permit {route.network}"
+
+        for (version, aspath, communities, largeCommunities, origin), (index, _) in routeDict.items():
+            yield f"route-map ROUTEGEN-RM permit {index}"
+            yield f"  match {"ip" if version == 4 else "ipv6"} address prefix-list ROUTEGEN-PL{index}"
+            yield f"  set as-path prepend {" ".join(map(str, aspath))}" if aspath else ""
+            yield f"  set community add {" ".join(map(format_community, communities))}" if communities else ""
+            yield f"  set large-community {" ".join(map(format_large_community, largeCommunities))} additive" if largeCommunities else ""
+            yield f"  set origin {origin}" if origin != "igp" else ""
 
         if localAS is not None:
-            config.append(f"router bgp {localAS}")
-            config.append(f"redistribute static route-map ROUTEGEN-RM")
-    
-    writeConfig(path=path, config="\n".join([x for x in config if x]))
+            yield f"router bgp {localAS}"
+            yield f"redistribute static route-map ROUTEGEN-RM"
+            if any(version == 6 for version, *_ in routeDict):
+                yield f"address-family ipv6 unicast"
+                yield f"  redistribute static route-map ROUTEGEN-RM"
+
+    writeConfig(path=path, config=(line for line in config() if line), fileName="ios.txt")
 
 def config_iosxr():
     """Generate route/policy configuration for Cisco IOS-XR-based platforms"""
     pass
 
-def config_junos(routes: list[Route], path: str, vrf: str = "", bgpGroup: str = None) -> None:
+def config_junos(batches: Iterable[RouteTable], path: str, vrf: str = "", bgpGroup: str = None) -> None:
     """Generate route/policy configurations for Juniper Junos-based platforms"""
-    config = []
-    baseCommand = f"set routing-instances {vrf}" if vrf else "set"
-    baseRouteCommand = " ".join([baseCommand, "routing-options static route"])
-    for route in routes:
-        command = f"{baseRouteCommand} {str(route.network)} discard"
-        command += f" community [ {" ".join(route.communities)} ]" if route.communities else ""
-        command += f" as-path path \"{" ".join(route.aspath)}\"" if route.aspath else ""
-        command += f" as-path origin {route.origin}" if route.origin != "igp" else ""
-        
-        config.append(command)
-    
-    basePolicyCommand = "set policy-options policy-statement ROUTEGEN-POLICY term 1"
-    config.append(f"{basePolicyCommand} from protocol static")
-    config.append(f"{basePolicyCommand} then accept")
-    
-    if bgpGroup is not None:
-        command += f"{baseCommand} protocols bgp group {bgpGroup} export ROUTEGEN-POLICY"
-    
-    writeConfig(path=path, config="\n".join(config))
+    def config() -> Iterator[str]:
+        baseCommand = f"set routing-instances {vrf}" if vrf else "set"
+        baseRouteCommand = " ".join([baseCommand, "routing-options static route"])
+        baseIPv6RouteCommand = " ".join([baseCommand, f"routing-options rib {f"{vrf}.inet6.0" if vrf else "inet6.0"} static route"])
+        for batch in batches:
+            for route in batch:
+                command = f"{baseRouteCommand if route.network.version == 4 else baseIPv6RouteCommand} {str(route.network)} discard"
+                communities = list(map(format_community, route.communities)) + [f"large:{format_large_community(community)}" for community in route.largeCommunities]
+                command += f" community [ {" ".join(communities)} ]" if communities else ""
+                command += f" as-path path \"{" ".join(map(str, route.aspath))}\"" if route.aspath else ""
+                command += f" as-path origin {route.origin}" if route.origin != "igp" else ""
+
+                yield command
+
+        basePolicyCommand = "set policy-options policy-statement ROUTEGEN-POLICY term 1"
+        yield f"{basePolicyCommand} from protocol static"
+        yield f"{basePolicyCommand} then accept"
+
+        if bgpGroup is not None:
+            yield f"{baseCommand} protocols bgp group {bgpGroup} export ROUTEGEN-POLICY"
+
+    writeConfig(path=path, config=config(), fileName="junos.txt")
 
-def config_container(path: str, outputPath: str, routes: list[Route], neighbors: list[Neighbor], rid: IPv4Address, userAttributes: dict[str, str]) -> None:
-    """Generate all required configuration to build the routebox container"""
-    templateLoader = (lambda fileName: Environment(loader=FileSystemLoader(path)).get_template(fileName))
+def config_container(batches: Iterable[RouteTable], path: str, outputPath: str, neighbors: list[Neighbor], rid: IPv4Address, userAttributes: dict[str, str],
+                     templatePath: str = CONTAINER_TEMPLATES) -> None:
+    """Generate all required configuration to build the routebox container, exporting a copy of its bird.conf to the given path"""
+    templateLoader = (lambda fileName: Environment(loader=FileSystemLoader(templatePath)).get_template(fileName))
 
+    routeCount = 0
+    def routes() -> Iterator[Route]:
+        nonlocal routeCount
+        for batch in batches:
+            routeCount += len(batch)
+            yield from batch
+
+    # Stream the rendered template to disk, hashing it on the way, so the full configuration never sits in memory
     birdTemplate = templateLoader("bird.conf.j2")
-    birdContent = birdTemplate.render(
-        rid=str(rid),
-        routes=routes,
-        neighbors=neighbors
-    )
+    birdContentHash = sha256()
+    with atomic_file(f"{templatePath}/bird.conf") as file:
+        for chunk in birdTemplate.generate(rid=str(rid), routes=routes(), neighbors=neighbors):
+            birdContentHash.update(chunk.encode("utf-8"))
+            file.write(chunk)
+    birdContentHash = str(birdContentHash.hexdigest())
+    copyfile(f"{templatePath}/bird.conf", f"{path}/{birdContentHash}.bird.conf")
 
-    birdContentHash = str(sha256(birdContent.encode("utf-8")).hexdigest())
     dockerTemplate = templateLoader("Dockerfile.j2")
     dockerContent = dockerTemplate.render(
         hash=birdContentHash
@@ -88,7 +129,7 @@ def config_container(path: str, outputPath: str, routes: list[Route], neighbors:
     sysAttributes = {
         "Date/Time Container Created": datetime.today().strftime("%m/%d/%Y at %H:%M:%S"),
         "bird.conf Hash": birdContentHash,
-        "Number of Routes": len(routes),
+        "Number of Routes": routeCount,
         "Number of Neighbors": len(neighbors),
         "BGP Router ID": rid
     }
@@ -99,16 +140,26 @@ def config_container(path: str, outputPath: str, routes: list[Route], neighbors:
         sysAttributes=sysAttributes
     )
 
-    for item in [f"{path}/bird.conf", f"{path}/../output/{birdContentHash}.bird.conf"]:
-        with open(item, "w") as file:
-            file.write(birdContent)
-
-    with open(f"{path}/docker-entrypoint.sh", "w") as file:
+    with open(f"{templatePath}/docker-entrypoint.sh", "w") as file:
         file.write(entrypointContent)
     
-    with open(f"{path}/Dockerfile", "w") as file:
+    with open(f"{templatePath}/Dockerfile", "w") as file:
         file.write(dockerContent)
 
-    buildContainer(dockerfilePath=f"{path}/Dockerfile",tarballPath=outputPath,birdConfHash=birdContentHash)
+    buildContainer(dockerfilePath=f"{templatePath}/Dockerfile",tarballPath=outputPath,birdConfHash=birdContentHash)
 
-platforms = {"ios": config_ios, "junos": config_junos, "container": config_container}
\ No newline at end of file
+platforms = {"ios": config_ios, "junos": config_junos, "container": config_container}
+
+def platform_writer(platform: str, config: dict[str, Any], path: str) -> Callable[[Iterable[RouteTable]], None]:
+    """Bind everything but the route batches to the writer of a platform, taking the container's settings from the config"""
+    if platform != "container":
+        return partial(platforms[platform], path=path)
+    container = config["container"]
+    return partial(
+        config_container,
+        path=container["configExport"]["location"] or path,
+        outputPath=osPath.join(container["imageExport"]["location"], container["imageExport"]["fileName"]),
+        neighbors=[Neighbor(address=neighbor["address"], asn=neighbor["asn"]) for neighbor in container["bgp"]["neighbors"]],
+        rid=IPv4Address(container["bgp"]["rid"]),
+        userAttributes={attribute["name"]: attribute["value"] for attribute in container.get("attributes") or []}
+    )
@@ -1,88 +1,414 @@
 """Contains all functions needed when generating a route object, its associated network, and any associated path/route attributes"""
-from ipaddress import IPv4Network, IPv4Address
-from random import randint, choices
-from src.objects import Route
-
-# The tests are defined as such:
-# def test_{testname}(address: IPv4Address) -> bool
-# Ensure that the test returns True/False based on the result
-# Add the function object itself for the test as a value to the enabledTest dict (key = description of the test)
-def test_global(address: IPv4Address) -> bool:
-    """Test to make sure that the address is a valid globally routable address"""
-    if not address.is_global:
-        return False
-    return True
-
-def runTests(address: IPv4Address) -> bool:
-    """Function to run the enabled tests and handle/raise failures/exceptions as required"""
-    enabledTests = {
-        "Test to make sure that the address is a valid globally routable address": test_global
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from collections import deque
+from typing import Any, Iterator
+import numpy as np
+from src.objects import RouteTable, ORIGIN_CODES
+from src.address_space import AddressSpace, IPv6AddressSpace
+from src.allocator import PrefixAllocator
+from src.permutation import FeistelPermutation
+from src.prng import CounterRNG
+from src.constraints import PrefixConstraint, ASPathConstraint, CommunityConstraint
+from src.sampler import AliasSampler
+from src.as_topology import ASTopology
+from src.overrides import Overrides
+from src.capacity import plan_capacity
+from src.exceptions import ConfigValidationTestFailedError
+
+# Independent streams of the counter-based generator, one per kind of random decision made for a route
+STREAM_ORDER = 0
+STREAM_NETWORK = 1
+STREAM_ALLOCATOR = 2
+STREAM_ASPATH = 3
+STREAM_ORIGIN = 4
+STREAM_PRIVATE_AS = 5
+STREAM_ASPATH_QUANTITY = 6
+STREAM_ASPATH_LENGTH = 7
+STREAM_TOPOLOGY = 8
+STREAM_ASPATH_ORIGIN = 9
+STREAM_COMMUNITY_QUANTITY = 10
+STREAM_COMMUNITY_LENGTH = 11
+STREAM_COMMUNITY = 12
+STREAM_LARGE_COMMUNITY = 13
+STREAM_INCLUDE_WELL_KNOWN = 14
+STREAM_WELL_KNOWN = 15
+STREAM_IPV6 = 16
+STREAM_ORIGIN_CONSTRAINT = 17
+STREAM_TRANSIT_CONSTRAINT = 18
+STREAM_COMMUNITY_CONSTRAINT = 19
+STREAM_COMMUNITY_CONSTRAINT_VALUE = 20
+STREAM_ASPATH_REDRAW = 21
+
+# Inclusive ASN bounds of every AS-PATH mode, without and with private ASNs
+ASN_BOUNDS = {
+    "2byte": ((1, 64512), (1, 65535)),
+    "4byte": ((65536, 4199999999), (65536, 4294967294)),
+    "2byte_4byte": ((1, 4199999999), (1, 4294967294))
+}
+# Well-known communities (RFC 1997 and RFC 3765): NO_EXPORT, NO_ADVERTISE, NO_EXPORT_SUBCONFED and NOPEER
+WELL_KNOWN_COMMUNITIES = [0xFFFFFF01, 0xFFFFFF02, 0xFFFFFF03, 0xFFFFFF04]
+# The (offset, length, pool) column names of every ragged attribute of a RouteTable
+RAGGED_COLUMNS = [
+    ("aspathOffset", "aspathLength", "asnPool"),
+    ("communityOffset", "communityLength", "communityPool"),
+    ("largeCommunityOffset", "largeCommunityLength", "largeCommunityPool")
+]
+# Route indices are spread this far apart in the counter space of per-item draws, more than the longest AS-PATH or community list a route table can hold
+ATTRIBUTE_STRIDE = 256
+MAX_LIST_LENGTH = 255
+# IPv6 prefix lengths used when an IPv6 family is enabled without prefixes.ipv6PrefixLengthRanges
+DEFAULT_IPV6_PREFIX_LENGTH_RANGES = [{"value": "/32-/48", "probability": 100}]
+
+def parse_range(value: str) -> tuple[int, int]:
+    """Parse a "min-max" (or single value) range from the configuration, ignoring any leading slashes used for prefix lengths"""
+    bounds = [int(bound.lstrip("/")) for bound in str(value).split("-")]
+    return bounds[0], bounds[-1]
+
+def parse_length_range(value: str, setting: str, limit: int = MAX_LIST_LENGTH) -> tuple[int, int]:
+    """Parse the range of a list length setting, which a route table's uint8 length columns (and ATTRIBUTE_STRIDE) cap at MAX_LIST_LENGTH"""
+    bounds = parse_range(value)
+    if bounds[1] > limit:
+        raise ConfigValidationTestFailedError(test=f"{setting} allows at most {limit} items per route, but {value} is configured")
+    return bounds
+
+def split_quantity(quantity: int, weights: list[int]) -> list[int]:
+    """Split a quantity proportionally to the weights, handing the remainder out by largest fractional part"""
+    shares = [quantity * weight / sum(weights) for weight in weights]
+    counts = [int(share) for share in shares]
+    for index in sorted(range(len(shares)), key=lambda index: counts[index] - shares[index])[:quantity - sum(counts)]:
+        counts[index] += 1
+    return counts
+
+def prefix_length_quotas(quantity: int, prefixLengthRanges: list[dict[str, Any]]) -> dict[int, int]:
+    """Work out how many networks of every prefix length to generate, from the probability of each configured range"""
+    quotas = {}
+    rangeQuantities = split_quantity(quantity=quantity, weights=[item["probability"] for item in prefixLengthRanges])
+    for item, rangeQuantity in zip(prefixLengthRanges, rangeQuantities):
+        minPL, maxPL = parse_range(item["value"])
+        # Spread each range's share evenly over the prefix lengths inside it
+        for prefixLength, count in zip(range(minPL, maxPL + 1), split_quantity(quantity=rangeQuantity, weights=[1] * (maxPL - minPL + 1))):
+            quotas[prefixLength] = quotas.get(prefixLength, 0) + count
+    return {prefixLength: count for prefixLength, count in sorted(quotas.items()) if count}
+
+def family_quotas(config: dict[str, Any]) -> dict[int, dict[int, int]]:
+    """Work out the prefix length quotas of every address family enabled in the configuration, keyed by IP version"""
+    prefixes = config["prefixes"]
+    quotas = {}
+    if config["basic"]["addressFamily"] in ("ipv4", "ipv4_ipv6"):
+        quotas[4] = prefix_length_quotas(quantity=prefixes["quantity"], prefixLengthRanges=prefixes["prefixLengthRanges"])
+    if config["basic"]["addressFamily"] in ("ipv6", "ipv4_ipv6"):
+        quotas[6] = prefix_length_quotas(quantity=prefixes.get("ipv6Quantity", prefixes["quantity"]), prefixLengthRanges=prefixes.get("ipv6PrefixLengthRanges", DEFAULT_IPV6_PREFIX_LENGTH_RANGES))
+    return quotas
+
+def generate_networks(quotas: dict[int, int], space: AddressSpace, rng: CounterRNG, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Generate the unique randomized networks of the routes at the given indices, returned as arrays of network addresses and prefix lengths"""
+    # A permutation over the whole table gives every route a slot, so that the prefix lengths are interleaved in the output
+    # and the network of route i depends on nothing but the seed and i
+    offsets = np.cumsum([0] + list(quotas.values()), dtype=np.uint64)
+    slots = FeistelPermutation(size=int(offsets[-1]), key=rng.key(STREAM_ORDER)).permute(indices)
+    buckets = np.searchsorted(offsets, slots, side="right") - 1
+
+    networks = np.empty(len(indices), dtype=space.dtype)
+    prefixLengths = np.array(list(quotas), dtype=np.uint8)[buckets]
+    for bucket, prefixLength in enumerate(quotas):
+        selected = buckets == bucket
+        # Walking a keyed permutation of the block index space yields distinct networks without any rejection or seen-set,
+        # so a network costs the same however much of the space the quota fills (even every /16 of the permitted space)
+        permutation = FeistelPermutation(size=space.capacity(prefixLength), key=rng.key(STREAM_NETWORK, prefixLength))
+        networks[selected] = space.networks(prefixLength, permutation.permute(slots[selected] - offsets[bucket]))
+
+    return networks, prefixLengths
+
+def generate_aspaths(mode: str, includePrivateAS: np.ndarray, lengthRanges: np.ndarray, rng: CounterRNG, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Generate the random AS-PATH of every route at the given indices, returned as per-route lengths and one contiguous pool of ASNs"""
+    minLengths, maxLengths = lengthRanges[:, 0].astype(np.uint64), lengthRanges[:, 1].astype(np.uint64)
+    lengths = (minLengths + rng.bits(STREAM_ASPATH_LENGTH, indices) % (maxLengths - minLengths + np.uint64(1))).astype(np.uint8)
+
+    # Every ASN is keyed by its route index and position in the path, so a route's AS-PATH does not depend on its batch
+    positions = np.arange(int(lengths.sum()), dtype=np.uint64) - np.repeat(RouteTable.offsets(lengths).astype(np.uint64), lengths)
+    counters = np.repeat(np.asarray(indices, dtype=np.uint64), lengths) * np.uint64(ATTRIBUTE_STRIDE) + positions
+    bounds = np.array(ASN_BOUNDS[mode], dtype=np.uint64)[np.repeat(np.asarray(includePrivateAS, dtype=np.intp), lengths)]
+    asnPool = bounds[:, 0] + rng.bits(STREAM_ASPATH, counters) % (bounds[:, 1] - bounds[:, 0] + np.uint64(1))
+    return lengths, asnPool.astype(np.uint32)
+
+def intern_sets(rows: np.ndarray, items: np.ndarray, count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Intern the sets of items (scalars or fixed-width rows) belonging to each of count rows, returning per-row offsets and lengths into a pool holding every distinct set once"""
+    columns = items.reshape(len(items), items.shape[1] if items.ndim == 2 else 1)
+    # Sort every set, then pad it into one row of a matrix (zero is never a valid item) so that identical sets are identical rows
+    order = np.lexsort(tuple(columns.T[::-1]) + (rows,))
+    columns, rows = columns[order], rows[order]
+    lengths = np.bincount(rows, minlength=count)
+    matrix = np.zeros((count, int(lengths.max(initial=0)), columns.shape[1]), dtype=columns.dtype)
+    matrix[rows, np.arange(len(rows)) - np.repeat(RouteTable.offsets(lengths), lengths)] = columns
+
+    # Group identical rows with a lexicographic sort and a comparison of neighbours (cheaper than np.unique(axis=0) on wide rows)
+    flat = matrix.reshape(count, -1)
+    order = np.lexsort(flat.T[::-1]) if flat.shape[1] else np.arange(count)
+    flat = flat[order]
+    first = np.ones(count, dtype=bool)
+    first[1:] = (flat[1:] != flat[:-1]).any(axis=1)
+    inverse = np.empty(count, dtype=np.int64)
+    inverse[order] = np.cumsum(first) - 1
+    unique = flat[first].reshape(int(first.sum()), *matrix.shape[1:])
+    present = unique.any(axis=2)
+    uniqueLengths = present.sum(axis=1)
+    pool = unique[present]
+    return RouteTable.offsets(uniqueLengths)[inverse], uniqueLengths[inverse], pool if items.ndim == 2 else pool[:, 0]
+
+def generate_communities(mode: str, includeWellKnown: np.ndarray, lengthRanges: np.ndarray, rng: CounterRNG, indices: np.ndarray,
+                         constraint: CommunityConstraint | None = None) -> tuple[np.ndarray, ...]:
+    """Generate the random standard and large BGP communities of every route at the given indices, interning identical sets into shared pools"""
+    minLengths, maxLengths = lengthRanges[:, 0].astype(np.uint64), lengthRanges[:, 1].astype(np.uint64)
+    lengths = (minLengths + rng.bits(STREAM_COMMUNITY_LENGTH, indices) % (maxLengths - minLengths + np.uint64(1))).astype(np.int64)
+
+    rows = np.repeat(np.arange(len(indices)), lengths)
+    positions = np.arange(len(rows), dtype=np.uint64) - np.repeat(RouteTable.offsets(lengths).astype(np.uint64), lengths)
+    counters = np.repeat(np.asarray(indices, dtype=np.uint64), lengths) * np.uint64(ATTRIBUTE_STRIDE) + positions
+    bits = rng.bits(STREAM_COMMUNITY, counters)
+    match mode:
+        case "standard":
+            large = np.zeros(len(bits), dtype=bool)
+        case "large":
+            large = np.ones(len(bits), dtype=bool)
+        case "standard_large":
+            large = (bits >> np.uint64(63)).astype(bool)
+
+    # Standard communities are ASN:value with a global administrator in 1-65534, packed into 32 bits
+    standard = ((np.uint64(1) + (bits >> np.uint64(16) & np.uint64(0xFFFF)) % np.uint64(65534)) << np.uint64(16)) | (bits & np.uint64(0xFFFF))
+    standardRows, standard = rows[~large], standard[~large]
+    wellKnown = np.flatnonzero(includeWellKnown)
+    standardRows = np.concatenate([standardRows, wellKnown])
+    standard = np.concatenate([standard, np.array(WELL_KNOWN_COMMUNITIES, dtype=np.uint64)[rng.bits(STREAM_WELL_KNOWN, indices[wellKnown]) % np.uint64(len(WELL_KNOWN_COMMUNITIES))]]).astype(np.uint32)
+
+    # Large communities are a 32-bit global administrator (1-4294967294) and two 32-bit local data parts
+    localBits = rng.bits(STREAM_LARGE_COMMUNITY, counters[large])
+    largeRows, largeCommunities = rows[large], np.stack([
+        np.uint64(1) + (bits[large] >> np.uint64(31) & np.uint64(0xFFFFFFFF)) % np.uint64(4294967294),
+        localBits & np.uint64(0xFFFFFFFF),
+        localBits >> np.uint64(32)
+    ], axis=1).astype(np.uint32)
+
+    if constraint:
+        standardHits, largeHits = constraint.standard_hits(standard), constraint.large_hits(largeCommunities)
+        if constraint.action == "exclude":
+            standardRows, standard, largeRows, largeCommunities = standardRows[~standardHits], standard[~standardHits], largeRows[~largeHits], largeCommunities[~largeHits]
+        else:
+            # Every route without a matching community gets one drawn from the patterns
+            missing = np.flatnonzero(~(np.bincount(standardRows, weights=standardHits, minlength=len(indices)) + np.bincount(largeRows, weights=largeHits, minlength=len(indices)) > 0))
+            drawnLarge, drawnStandard, drawnLargeCommunities = constraint.draw(
+                uniforms=rng.uniform(STREAM_COMMUNITY_CONSTRAINT, indices[missing]), bits=rng.bits(STREAM_COMMUNITY_CONSTRAINT_VALUE, indices[missing]))
+            standardRows, standard = np.concatenate([standardRows, missing[~drawnLarge]]), np.concatenate([standard, drawnStandard[~drawnLarge]])
+            largeRows, largeCommunities = np.concatenate([largeRows, missing[drawnLarge]]), np.concatenate([largeCommunities, drawnLargeCommunities[drawnLarge]])
+
+    communityOffset, communityLength, communityPool = intern_sets(rows=standardRows, items=standard, count=len(indices))
+    largeCommunityOffset, largeCommunityLength, largeCommunityPool = intern_sets(rows=largeRows, items=largeCommunities, count=len(indices))
+
+    return communityOffset, communityLength, communityPool, largeCommunityOffset, largeCommunityLength, largeCommunityPool
+
+def generate_origin(sampler: AliasSampler, uniforms: np.ndarray) -> np.ndarray:
+    """Choose an origin code (as an index into ORIGIN_CODES) for every route, based on the probabilities in the configuration"""
+    return sampler.sample(uniforms).astype(np.uint8)
+
+def build_samplers(config: dict[str, Any]) -> dict[str, Any]:
+    """Precompute the alias tables of every probability-weighted list that route generation draws from"""
+    aspathConfig = config["bgp"]["aspath"]
+    samplers = {
+        "aspathQuantity": AliasSampler(values=[parse_length_range(option["value"], "bgp.aspath.quantity") for option in aspathConfig["quantity"]], weights=[option["probability"] for option in aspathConfig["quantity"]]),
+        "includePrivateAS": AliasSampler.from_config(aspathConfig["includePrivateAS"]),
+        "origin": AliasSampler(values=[ORIGIN_CODES.index(option["value"]) for option in config["bgp"]["origin"]], weights=[option["probability"] for option in config["bgp"]["origin"]])
     }
-    for test in enabledTests:
-        if not enabledTests[test](address):
-            return False
-    return True
-
-def generate_network(minPL: int, maxPL: int) -> str:
-    """Generate a randomized IPv4/IPv6 network, based on provided constraints in the configuration"""
-    while True:
-        # Generate random IP address between 1.0.0.0 and 223.255.255.255 (0.0.0.0/8 = reserved, 224.0.0.0/4 = multicast, 240.0.0.0/4 = reserved) and make sure that it passes all defined tests
-        address = IPv4Address(randint(16777216, 3758096383))
-        if not runTests(address=address):
-            continue
-
-        prefixLength = randint(minPL, maxPL)
-
-        return f"{str(address)}/{prefixLength}"
-    
-def generate_aspath(mode: str, include_privateAS: bool, maxLength: int) -> list[str]:
-    """Generate a random AS-PATH sequence containing 2 and/or 4-byte private and/or public ASNs, based on provided constraints in the configuration"""
-    aspath = []
-    match (mode, include_privateAS):
-        case ("2byte", True):
-            minAS = 1
-            maxAS = 65535
-        case ("2byte", False):
-            minAS = 1
-            maxAS = 64512
-        case ("4byte", True):
-            minAS = 65536
-            maxAS = 4296967294
-        case ("4byte", False):
-            minAS = 65536
-            maxAS = 4199999999
-        case ("24byte", True):
-            minAS = 1
-            maxAS = 4296967294
-        case ("24byte", False):
-            minAS = 1
-            maxAS = 4199999999
-
-    for i in range(randint(1, maxLength)):
-        aspath.append(str(randint(minAS, maxAS)))
-    
-    return aspath
-
-def generate_communities() -> list[str]:
-    """Generate BGP communities for the route"""
-    pass
-
-def generate_origin(probabilities: list[int]) -> str:
-    """Randomly choose an origin code for the route based on the provided probabilities"""
-    originCodes = ["igp", "egp", "incomplete"]
-
-    return choices(originCodes)[0]
-
-def generateRoutes() -> Route:
-    """Construct a route object"""
-    network = generate_network()
-    aspath = generate_aspath()
-    communities = generate_communities()
-    origin = generate_origin()
-
-    return Route(
-        network=IPv4Network(network, strict=False),
-        aspath=aspath,
-        communities=communities,
-        origin=origin
-    )
\ No newline at end of file
+    communityConfig = config["bgp"].get("communities")
+    if communityConfig:
+        # A route can get a well-known community and one drawn by a community constraint on top of the configured quantity
+        samplers["communityQuantity"] = AliasSampler(values=[parse_length_range(option["value"], "bgp.communities.quantity", limit=MAX_LIST_LENGTH - 2) for option in communityConfig["quantity"]], weights=[option["probability"] for option in communityConfig["quantity"]])
+        samplers["includeWellKnown"] = AliasSampler.from_config(communityConfig.get("includeWellKnown", [{"value": False, "probability": 100}]))
+    # The AS path and community constraints are compiled alongside, as they steer the same draws
+    constraints = config.get("policy", {}).get("constraints", {})
+    for name, constraint in (("aspathConstraint", ASPathConstraint.from_config(constraints.get("bgp_aspath"))), ("communityConstraint", CommunityConstraint.from_config(constraints.get("bgp_communities")))):
+        if constraint:
+            samplers[name] = constraint
+    return samplers
+
+def address_spaces(config: dict[str, Any]) -> dict[int, AddressSpace]:
+    """Build the permitted address space of every address family enabled in the configuration, with the prefix constraint compiled into it"""
+    constraint = config.get("policy", {}).get("constraints", {}).get("prefix")
+    spaces = {}
+    for family in family_quotas(config=config):
+        if family == 4:
+            spaces[4] = AddressSpace(includePrivateSpace=config["prefixes"].get("includePrivateSpace", False), constraint=PrefixConstraint.from_config(constraint, version=4))
+        else:
+            spaces[6] = IPv6AddressSpace(constraint=PrefixConstraint.from_config(constraint, version=6))
+    return spaces
+
+def generate_attributes(config: dict[str, Any], samplers: dict[str, Any], rng: CounterRNG, indices: np.ndarray, topology: ASTopology | None = None) -> dict[str, np.ndarray]:
+    """Generate the path attributes of the routes at the given indices, returned as RouteTable columns"""
+    mode = config["bgp"]["aspath"]["mode"]
+    if topology:
+        # Routes reuse the cached path of their origin AS, so routes from the same origin share one run of the pool
+        aspathOffsets, aspathLengths = topology.aspaths(rng.uniform(STREAM_ASPATH_ORIGIN, indices))
+        asnPool = topology.pathPool
+        includePrivateAS = np.zeros(len(indices), dtype=bool)
+    else:
+        includePrivateAS = samplers["includePrivateAS"].sample(rng.uniform(STREAM_PRIVATE_AS, indices))
+        aspathLengths, asnPool = generate_aspaths(
+            mode=mode,
+            includePrivateAS=includePrivateAS,
+            lengthRanges=samplers["aspathQuantity"].sample(rng.uniform(STREAM_ASPATH_QUANTITY, indices)),
+            rng=rng,
+            indices=indices
+        )
+        aspathOffsets = RouteTable.offsets(aspathLengths)
+
+    if "aspathConstraint" in samplers:
+        if topology:
+            # Steering rewrites paths in place, so routes sharing a cached topology path each get their own copy of it
+            positions = np.arange(int(aspathLengths.astype(np.int64).sum())) - np.repeat(RouteTable.offsets(aspathLengths).astype(np.int64), aspathLengths)
+            asnPool = asnPool[np.repeat(aspathOffsets.astype(np.int64), aspathLengths) + positions]
+        redrawUniforms = None
+        if samplers["aspathConstraint"].action == "exclude":
+            # Redrawn ASNs are keyed by route index and path position, like the ASNs they replace
+            positions = np.arange(len(asnPool), dtype=np.uint64) - np.repeat(RouteTable.offsets(aspathLengths).astype(np.uint64), aspathLengths)
+            redrawUniforms = rng.uniform(STREAM_ASPATH_REDRAW, np.repeat(np.asarray(indices, dtype=np.uint64), aspathLengths) * np.uint64(ATTRIBUTE_STRIDE) + positions)
+        aspathLengths, asnPool = samplers["aspathConstraint"].steer(
+            lengths=aspathLengths, pool=asnPool, bounds=np.array(ASN_BOUNDS[mode], dtype=np.int64)[np.asarray(includePrivateAS, dtype=np.intp)],
+            originUniforms=rng.uniform(STREAM_ORIGIN_CONSTRAINT, indices), transitUniforms=rng.uniform(STREAM_TRANSIT_CONSTRAINT, indices),
+            redrawUniforms=redrawUniforms
+        )
+        aspathOffsets = RouteTable.offsets(aspathLengths)
+
+    if "communityQuantity" in samplers:
+        communities = generate_communities(
+            mode=config["bgp"]["communities"]["mode"],
+            includeWellKnown=samplers["includeWellKnown"].sample(rng.uniform(STREAM_INCLUDE_WELL_KNOWN, indices)),
+            lengthRanges=samplers["communityQuantity"].sample(rng.uniform(STREAM_COMMUNITY_QUANTITY, indices)),
+            rng=rng,
+            indices=indices,
+            constraint=samplers.get("communityConstraint")
+        )
+    else:
+        empty = np.zeros(len(indices), dtype=np.uint32)
+        communities = (empty, empty, np.empty(0, dtype=np.uint32), empty, empty, np.empty((0, 3), dtype=np.uint32))
+
+    return dict(
+        origin=generate_origin(sampler=samplers["origin"], uniforms=rng.uniform(STREAM_ORIGIN, indices)),
+        aspathOffset=aspathOffsets,
+        aspathLength=aspathLengths,
+        asnPool=asnPool,
+        **dict(zip(["communityOffset", "communityLength", "communityPool", "largeCommunityOffset", "largeCommunityLength", "largeCommunityPool"], communities))
+    )
+
+def merge_attributes(groups: np.ndarray, attributes: dict[int, dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    """Put the attribute columns generated for every group of routes back into table order, concatenating the pools they point into"""
+    merged = {"origin": np.empty(len(groups), dtype=np.uint8)}
+    for group, columns in attributes.items():
+        merged["origin"][groups == group] = columns["origin"]
+    for offsetName, lengthName, poolName in RAGGED_COLUMNS:
+        merged[offsetName] = np.empty(len(groups), dtype=np.uint32)
+        merged[lengthName] = np.empty(len(groups), dtype=np.uint8)
+        pools, bases, size = [], {}, 0
+        for group, columns in attributes.items():
+            selected = groups == group
+            # Groups sharing a pool object (such as the AS topology's path pool) share one copy of it
+            if id(columns[poolName]) not in bases:
+                bases[id(columns[poolName])] = size
+                pools.append(columns[poolName])
+                size += len(columns[poolName])
+            merged[offsetName][selected] = columns[offsetName] + bases[id(columns[poolName])]
+            merged[lengthName][selected] = columns[lengthName]
+        merged[poolName] = np.concatenate(pools) if pools else np.empty(0, dtype=np.uint32)
+    return merged
+
+def generateRouteShard(config: dict[str, Any], seed: int, samplers: dict[str, Any], space: AddressSpace, start: int, stop: int,
+                       topology: ASTopology | None = None, overrides: Overrides | None = None) -> RouteTable:
+    """Generate the routes at indices [start, stop) of the table of the address space's family as a columnar route table, cheap to hand back from a worker process"""
+    rng = CounterRNG(seed=seed)
+    if space.version == 6:
+        # The IPv6 table draws from a generator of its own, so its routes do not repeat the attributes of the IPv4 routes at the same indices
+        rng = CounterRNG(seed=rng.key(STREAM_IPV6))
+    quotas = family_quotas(config=config)[space.version]
+    indices = np.arange(start, stop)
+    if config["prefixes"].get("allowOverlap", True):
+        networks, prefixLengths = generate_networks(quotas=quotas, space=space, rng=rng, indices=indices)
+    else:
+        # The allocator is stateful, so the whole table is allocated in one pass from a seed derived from the route seed
+        allIndices = np.arange(sum(quotas.values()))
+        prefixLengths = np.repeat(list(quotas), list(quotas.values())).astype(np.uint8)
+        prefixLengths = prefixLengths[FeistelPermutation(size=len(allIndices), key=rng.key(STREAM_ORDER)).permute(allIndices)]
+        networks = PrefixAllocator(space=space, seed=rng.key(STREAM_ALLOCATOR)).allocate_many(prefixLengths=prefixLengths)
+        networks, prefixLengths = networks[indices], prefixLengths[indices]
+    if space.version == 6:
+        # IPv6 networks are generated as the upper 64 bits of the address, and stored as (upper, lower) pairs
+        networks = np.stack([networks, np.zeros_like(networks)], axis=1)
+
+    if overrides:
+        # Routes are grouped by the override they fall under (-1 for none), and every group draws its attributes from its own configuration
+        groups = overrides.lookup(network=networks, prefixLength=prefixLengths)
+        attributes = merge_attributes(groups=groups, attributes={
+            group: generate_attributes(
+                config=config if group < 0 else overrides.configs[group],
+                samplers=samplers if group < 0 else overrides.samplers[group],
+                rng=rng,
+                indices=indices[groups == group],
+                topology=topology
+            ) for group in np.unique(groups).tolist()
+        })
+    else:
+        attributes = generate_attributes(config=config, samplers=samplers, rng=rng, indices=indices, topology=topology)
+
+    return RouteTable(network=networks, prefixLength=prefixLengths, **attributes)
+
+def batches(table: RouteTable, batchSize: int) -> Iterator[RouteTable]:
+    """Split a route table into batches that share its pools"""
+    for start in range(0, len(table), batchSize):
+        yield table.slice(start, start + batchSize)
+
+def planRouteGeneration(config: dict[str, Any]) -> dict[str, Any]:
+    """Validate the configuration and precompute everything route generation shares, raising before any route is generated or written
+    if the configuration cannot be met"""
+    quotas = family_quotas(config=config)
+    # Resolve the seed once, so that every shard draws from the same generator even when no route seed is configured
+    seed = CounterRNG.from_route_seed(config["prefixes"].get("routeSeed")).seed
+    samplers = build_samplers(config=config)
+    spaces = address_spaces(config=config)
+    # Fail before any worker starts if the permitted space cannot hold the requested networks
+    plan_capacity(quotas=quotas, spaces=spaces, allowOverlap=config["prefixes"].get("allowOverlap", True))
+    overrides = Overrides(config=config, samplerFactory=build_samplers)
+    aspathConfig = config["bgp"]["aspath"]
+    topology = None
+    if aspathConfig.get("model", "random") == "topology":
+        # The graph and its paths are built once per seed and shared by every shard
+        quantity = sum(sum(familyQuotas.values()) for familyQuotas in quotas.values())
+        topology = ASTopology.for_routes(quantity=quantity, asnBounds=ASN_BOUNDS[aspathConfig["mode"]][0], seed=CounterRNG(seed=seed).key(STREAM_TOPOLOGY))
+    return dict(quotas=quotas, seed=seed, samplers=samplers, spaces=spaces, overrides=overrides, topology=topology)
+
+def generateRouteBatches(config: dict[str, Any], workers: int = 1, batchSize: int = 8192, plan: dict[str, Any] | None = None) -> Iterator[RouteTable]:
+    """Yield the routes requested in the configuration in batches, optionally generating them across worker processes. The plan from
+    planRouteGeneration is made here if it is not passed in, though only once the first batch is requested"""
+    plan = plan or planRouteGeneration(config=config)
+    quotas, seed, samplers, spaces, overrides, topology = (plan[name] for name in ("quotas", "seed", "samplers", "spaces", "overrides", "topology"))
+
+    # Every address family is a table of its own (IPv4 first), split into shards that never straddle two families.
+    # The allocator works on a whole table at once, so in that mode a table is generated as a single shard and batched afterwards
+    shards = []
+    for family, familyQuotas in quotas.items():
+        quantity = sum(familyQuotas.values())
+        step = batchSize if config["prefixes"].get("allowOverlap", True) else max(quantity, 1)
+        shards += [(family, start, min(start + step, quantity)) for start in range(0, quantity, step)]
+
+    if workers == 1:
+        for family, start, stop in shards:
+            yield from batches(table=generateRouteShard(config=config, seed=seed, samplers=samplers, space=spaces[family], start=start, stop=stop, topology=topology, overrides=overrides), batchSize=batchSize)
+        return
+
+    # Shards are disjoint slices of the same table-wide permutation, so the merged routes are globally unique by construction.
+    # Only a bounded number of shards is kept in flight, so memory stays flat however large the table is
+    # The platform writers already run in threads by now, so workers are started from a forkserver rather than forked from this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("forkserver")) as executor:
+        pending = deque()
+        for family, start, stop in shards:
+            pending.append(executor.submit(generateRouteShard, config, seed, samplers, spaces[family], start, stop, topology, overrides))
+            if len(pending) >= 2 * workers:
+                yield from batches(table=pending.popleft().result(), batchSize=batchSize)
+        while pending:
+            yield from batches(table=pending.popleft().result(), batchSize=batchSize)
@@ -0,0 +1,395 @@
+"""Contains the streaming reader of MRT TABLE_DUMP_V2 routing table dumps (RFC 6396), which turns a RIB dump into route batches"""
+from ipaddress import ip_address, IPv4Address, IPv6Address
+from bz2 import BZ2Decompressor
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import get_context
+from mmap import mmap, ACCESS_READ
+from queue import Queue
+from struct import Struct, unpack_from
+from threading import Event, Thread
+from typing import Any, Callable, Generator, Iterable, Iterator
+from zlib import decompressobj
+import numpy as np
+from src.objects import RouteTable
+from src.constraints import PrefixConstraint, ASPathConstraint, CommunityConstraint
+from src.exceptions import MRTFormatError
+from src.generate_routes import batches
+from src.mrt_cache import MRTCache
+
+TABLE_DUMP_V2 = 13
+PEER_INDEX_TABLE = 1
+# RIB subtypes that are read, mapped to their IP version and whether their entries carry an ADD-PATH path identifier (RFC 8050)
+RIB_SUBTYPES = {2: (4, False), 4: (6, False), 8: (4, True), 10: (6, True)}
+
+ATTRIBUTE_ORIGIN = 1
+ATTRIBUTE_AS_PATH = 2
+ATTRIBUTE_COMMUNITIES = 8
+ATTRIBUTE_LARGE_COMMUNITIES = 32
+EXTENDED_LENGTH = 0x10
+# Longest AS path or community list a RouteTable row can hold (its length columns are uint8), longer lists are truncated
+MAX_LIST_LENGTH = 255
+
+# Compressed dumps are recognised by their magic bytes and decompressed this many compressed bytes at a time, at most this many
+# decompressed chunks ahead of the decoder (gzip members are decoded by zlib with a gzip header, wbits 16 + 15)
+COMPRESSED_FORMATS = {b"\x1f\x8b": lambda: decompressobj(wbits=31), b"BZh": BZ2Decompressor}
+COMPRESSED_CHUNK_SIZE = 1 << 20
+DECOMPRESSED_CHUNKS = 4
+
+HEADER = Struct("!IHHI")
+RIB_HEADER = Struct("!IB")
+ENTRY = Struct("!HIH")
+ADDPATH_ENTRY = Struct("!HIIH")
+UINT16 = Struct("!H")
+LENGTH = Struct("!I")
+# Uncompressed dumps are decoded across worker processes in record-aligned chunks of about this size
+CHUNK_SIZE = 16 << 20
+
+class MRTReader:
+    """MRT dump mapped into memory, decoded record by record straight from the mapping without copying the records out"""
+    def __init__(self, path: str, peer: str | None = None):
+        self.path = path
+        # Only the entries of this peer (by address) are read, or the first entry of every prefix if no peer is set
+        self.peer = ip_address(peer) if peer else None
+        self.peers = []
+        # Distinct raw path attribute blobs, each decoded once and referred to by every route carrying it through its index
+        self.attributeSets = {}
+        self.attributes = []
+
+    def walk(self, view: memoryview, final: bool = True) -> Generator[tuple[int, int, memoryview], None, int]:
+        """Yield the type, subtype and body of every complete record in the view, returning the offset where the unread tail starts.
+        A truncated last record is an error at the end of the dump, but only the part of it still to come in the middle of a stream"""
+        offset, body = 0, None
+        try:
+            while offset + HEADER.size <= len(view):
+                _, recordType, subtype, length = HEADER.unpack_from(view, offset)
+                if offset + HEADER.size + length > len(view):
+                    break
+                body = view[offset + HEADER.size:offset + HEADER.size + length]
+                yield recordType, subtype, body
+                body.release()
+                offset += HEADER.size + length
+        finally:
+            # The mapping can only be closed once no view into it is left
+            if body is not None:
+                body.release()
+        if final and offset < len(view):
+            raise MRTFormatError(path=self.path, reason=f"record at byte {offset} is truncated")
+        return offset
+
+    def compression(self) -> Callable[[], Any] | None:
+        """Return the decompressor factory of a compressed dump, or None for an uncompressed one"""
+        try:
+            with open(self.path, "rb") as file:
+                magic = file.read(3)
+        except OSError as e:
+            raise MRTFormatError(path=self.path, reason=e.strerror or str(e)) from e
+        return next((factory for prefix, factory in COMPRESSED_FORMATS.items() if magic.startswith(prefix)), None)
+
+    @contextmanager
+    def mapping(self) -> Iterator[mmap]:
+        """Map an uncompressed dump into memory, reporting a missing, unreadable or empty file as an MRTFormatError"""
+        try:
+            file = open(self.path, "rb")
+        except OSError as e:
+            raise MRTFormatError(path=self.path, reason=e.strerror or str(e)) from e
+        with file:
+            try:
+                mapping = mmap(file.fileno(), 0, access=ACCESS_READ)
+            except (OSError, ValueError) as e:
+                # Only an empty file cannot be mapped with a ValueError
+                raise MRTFormatError(path=self.path, reason="the file is empty" if isinstance(e, ValueError) else e.strerror or str(e)) from e
+            with mapping:
+                yield mapping
+
+    def records(self, start: int = 0, stop: int | None = None) -> Iterator[tuple[int, int, memoryview]]:
+        """Yield the type, subtype and body of every record in the dump (or in bytes [start, stop) of an uncompressed one, which must be
+        record-aligned), decompressing gzip and bzip2 dumps on the fly"""
+        factory = self.compression()
+        if factory:
+            yield from self.stream(factory)
+            return
+        with self.mapping() as mapping:
+            view = memoryview(mapping)[start:stop]
+            try:
+                yield from self.walk(view)
+            finally:
+                view.release()
+
+    def chunks(self, chunkSize: int) -> list[tuple[int, int]]:
+        """Split an uncompressed dump into record-aligned byte ranges of about the chunk size, reading nothing but the record headers"""
+        with self.mapping() as mapping:
+            boundaries, offset, size = [0], 0, len(mapping)
+            # Hop from header to header, only decoding the length field of each one
+            while offset + HEADER.size <= size:
+                offset += HEADER.size + LENGTH.unpack_from(mapping, offset + 8)[0]
+                if offset - boundaries[-1] >= chunkSize:
+                    boundaries.append(offset)
+            if boundaries[-1] < size:
+                boundaries.append(size)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def read_peers(self):
+        """Decode the PEER_INDEX_TABLE at the start of the dump, which decoding any chunk of RIB records on its own requires"""
+        for recordType, subtype, body in self.records():
+            if recordType == TABLE_DUMP_V2 and subtype == PEER_INDEX_TABLE:
+                self.read_peer_index(body)
+                return
+
+    def stream(self, factory: Callable[[], Any]) -> Iterator[tuple[int, int, memoryview]]:
+        """Yield the records of a compressed dump, decompressed by a background thread that stays a bounded number of chunks ahead.
+        The decompressors release the GIL while they work on a whole chunk, so decompression overlaps with decoding instead of taking turns with it"""
+        chunks, stop = Queue(maxsize=DECOMPRESSED_CHUNKS), Event()
+
+        def decompress():
+            try:
+                with open(self.path, "rb") as file:
+                    decompressor = factory()
+                    while not stop.is_set() and (raw := file.read(COMPRESSED_CHUNK_SIZE)):
+                        # A dump may be several concatenated members (streams), each needing a fresh decompressor
+                        while raw:
+                            if decompressor.eof:
+                                decompressor = factory()
+                            chunk = decompressor.decompress(raw)
+                            raw = decompressor.unused_data if decompressor.eof else b""
+                            if chunk:
+                                chunks.put(chunk)
+                    if not stop.is_set() and not decompressor.eof:
+                        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+                chunks.put(None)
+            except Exception as e:
+                chunks.put(e)
+
+        thread = Thread(target=decompress, daemon=True)
+        thread.start()
+        try:
+            tail = b""
+            while True:
+                chunk = chunks.get()
+                if isinstance(chunk, Exception):
+                    raise MRTFormatError(path=self.path, reason=str(chunk))
+                # Records straddling two chunks are reassembled from the tail left over by the previous chunk
+                data = memoryview(tail + chunk if chunk is not None else tail)
+                offset = yield from self.walk(data, final=chunk is None)
+                tail = bytes(data[offset:])
+                data.release()
+                if chunk is None:
+                    break
+        finally:
+            # Unblock the decompressor if decoding stopped early, so the thread can see the stop flag and exit
+            stop.set()
+            while thread.is_alive():
+                while not chunks.empty():
+                    chunks.get_nowait()
+                thread.join(timeout=0.1)
+
+    def read_peer_index(self, body: memoryview):
+        """Decode the PEER_INDEX_TABLE, which every RIB entry refers to by position"""
+        viewNameLength = UINT16.unpack_from(body, 4)[0]
+        offset = 6 + viewNameLength
+        count = UINT16.unpack_from(body, offset)[0]
+        offset += 2
+        self.peers = []
+        for _ in range(count):
+            # Bit 0 of the peer type marks an IPv6 peer address, bit 1 a four-octet peer ASN
+            peerType = body[offset]
+            addressLength, asnLength = 16 if peerType & 1 else 4, 4 if peerType & 2 else 2
+            address = (IPv6Address if peerType & 1 else IPv4Address)(bytes(body[offset + 5:offset + 5 + addressLength]))
+            offset += 5 + addressLength
+            asn = int.from_bytes(body[offset:offset + asnLength], "big")
+            offset += asnLength
+            self.peers.append((address, asn))
+        # A peer missing from the index would silently skip every RIB entry and leave an empty table
+        if self.peer is not None and all(address != self.peer for address, _ in self.peers):
+            raise MRTFormatError(path=self.path, reason=f"peer {self.peer} is not in the dump")
+
+    @staticmethod
+    def decode_attributes(body: memoryview, offset: int, end: int) -> tuple[int, tuple[int, ...], tuple[int, ...], tuple[tuple[int, int, int], ...]]:
+        """Decode the origin, AS path, communities and large communities from the path attributes in body[offset:end]"""
+        origin, aspath, communities, largeCommunities = 0, (), (), ()
+        while offset < end:
+            flags, attributeType = body[offset], body[offset + 1]
+            if flags & EXTENDED_LENGTH:
+                length, offset = UINT16.unpack_from(body, offset + 2)[0], offset + 4
+            else:
+                length, offset = body[offset + 2], offset + 3
+            if attributeType == ATTRIBUTE_ORIGIN:
+                origin = body[offset]
+            elif attributeType == ATTRIBUTE_AS_PATH:
+                # TABLE_DUMP_V2 always encodes four-octet ASNs. AS_SET members are flattened into the path, as a RouteTable row is a plain ASN list
+                segments, position = [], offset
+                while position < offset + length:
+                    count = body[position + 1]
+                    segments += unpack_from(f"!{count}I", body, position + 2)
+                    position += 2 + 4 * count
+                aspath = tuple(segments[:MAX_LIST_LENGTH])
+            elif attributeType == ATTRIBUTE_COMMUNITIES:
+                communities = unpack_from(f"!{min(length // 4, MAX_LIST_LENGTH)}I", body, offset)
+            elif attributeType == ATTRIBUTE_LARGE_COMMUNITIES:
+                values = unpack_from(f"!{3 * min(length // 12, MAX_LIST_LENGTH)}I", body, offset)
+                largeCommunities = tuple(zip(values[0::3], values[1::3], values[2::3]))
+            offset += length
+        return origin, aspath, communities, largeCommunities
+
+    def attribute_set(self, body: memoryview, offset: int, end: int) -> int:
+        """Return the index of the attribute set in body[offset:end], decoding it only the first time the raw blob is seen"""
+        blob = body[offset:end].tobytes()
+        attributeSet = self.attributeSets.get(blob)
+        if attributeSet is None:
+            attributeSet = self.attributeSets[blob] = len(self.attributes)
+            self.attributes.append(self.decode_attributes(body, offset, end))
+        return attributeSet
+
+    def read_rib(self, body: memoryview, version: int, addPath: bool) -> tuple[int, int, int] | None:
+        """Decode the prefix of a RIB record and the attribute set index of its selected entry, or return None if the selected peer has no entry"""
+        _, prefixLength = RIB_HEADER.unpack_from(body, 0)
+        prefixBytes = (prefixLength + 7) // 8
+        network = int.from_bytes(body[5:5 + prefixBytes], "big") << ((32 if version == 4 else 128) - 8 * prefixBytes)
+        offset = 5 + prefixBytes
+        count = UINT16.unpack_from(body, offset)[0]
+        offset += 2
+        entry = ADDPATH_ENTRY if addPath else ENTRY
+        for _ in range(count):
+            fields = entry.unpack_from(body, offset)
+            peerIndex, attributeLength = fields[0], fields[-1]
+            offset += entry.size
+            if self.peer is None or (peerIndex < len(self.peers) and self.peers[peerIndex][0] == self.peer):
+                return network, prefixLength, self.attribute_set(body, offset, offset + attributeLength)
+            offset += attributeLength
+        return None
+
+    def routes(self, start: int = 0, stop: int | None = None) -> Iterator[tuple[int, int, int, int]]:
+        """Yield the IP version, network address, prefix length and attribute set index of every route in the dump (or in a chunk of it)"""
+        for recordType, subtype, body in self.records(start, stop):
+            if recordType != TABLE_DUMP_V2:
+                continue
+            if subtype == PEER_INDEX_TABLE:
+                self.read_peer_index(body)
+            elif subtype in RIB_SUBTYPES:
+                version, addPath = RIB_SUBTYPES[subtype]
+                route = self.read_rib(body, version, addPath)
+                if route:
+                    yield version, *route
+
+def build_table(version: int, routes: list[tuple[int, int, int]], attributes: list[tuple]) -> RouteTable:
+    """Pack decoded routes of one IP version into a columnar route table, where routes with the same attribute set share its runs of the pools"""
+    networks, prefixLengths, attributeSets = zip(*routes)
+    if version == 4:
+        network = np.array(networks, dtype=np.uint32)
+    else:
+        network = np.array([(address >> 64, address & 0xFFFFFFFFFFFFFFFF) for address in networks], dtype=np.uint64).reshape(-1, 2)
+    # Every distinct attribute set of the batch is written to the pools once
+    unique, inverse = np.unique(np.array(attributeSets, dtype=np.int64), return_inverse=True)
+    origins, aspaths, communities, largeCommunities = zip(*(attributes[attributeSet] for attributeSet in unique.tolist()))
+    aspathLength = np.array([len(aspath) for aspath in aspaths], dtype=np.uint8)
+    communityLength = np.array([len(items) for items in communities], dtype=np.uint8)
+    largeCommunityLength = np.array([len(items) for items in largeCommunities], dtype=np.uint8)
+    return RouteTable(
+        network=network, prefixLength=np.array(prefixLengths, dtype=np.uint8), origin=np.array(origins, dtype=np.uint8)[inverse],
+        aspathOffset=RouteTable.offsets(aspathLength)[inverse], aspathLength=aspathLength[inverse],
+        asnPool=np.fromiter((asn for aspath in aspaths for asn in aspath), dtype=np.uint32),
+        communityOffset=RouteTable.offsets(communityLength)[inverse], communityLength=communityLength[inverse],
+        communityPool=np.fromiter((community for items in communities for community in items), dtype=np.uint32),
+        largeCommunityOffset=RouteTable.offsets(largeCommunityLength)[inverse], largeCommunityLength=largeCommunityLength[inverse],
+        largeCommunityPool=np.array([community for items in largeCommunities for community in items], dtype=np.uint32).reshape(-1, 3)
+    )
+
+def constraint_mask(table: RouteTable, constraints: list) -> np.ndarray:
+    """Return True for every route of the table that all the compiled constraints accept"""
+    mask = np.ones(len(table), dtype=bool)
+    for constraint in constraints:
+        mask &= constraint.mask(table)
+    return mask
+
+def route_tables(reader: MRTReader, routes: Iterable[tuple[int, int, int, int]], families: set[int], batchSize: int) -> Iterator[RouteTable]:
+    """Pack the reader's decoded routes of the enabled families into tables of at most batchSize routes, which never mix IP versions"""
+    pending, pendingVersion = [], None
+    for version, network, prefixLength, attributeSet in routes:
+        if version not in families:
+            continue
+        if pending and (version != pendingVersion or len(pending) >= batchSize):
+            yield build_table(pendingVersion, pending, reader.attributes)
+            pending = []
+        pending.append((network, prefixLength, attributeSet))
+        pendingVersion = version
+    if pending:
+        yield build_table(pendingVersion, pending, reader.attributes)
+
+def read_chunk(path: str, peer: str | None, peers: list[tuple[Any, int]], families: set[int], start: int, stop: int, batchSize: int) -> list[RouteTable]:
+    """Decode the routes in bytes [start, stop) of an uncompressed dump as columnar route tables, cheap to hand back from a worker process"""
+    reader = MRTReader(path=path, peer=peer)
+    reader.peers = peers
+    return list(route_tables(reader, reader.routes(start, stop), families=families, batchSize=batchSize))
+
+def next_finished(pending: deque[Future], keepOrder: bool) -> Future:
+    """Remove and return the oldest pending future, or the first one to finish if the order does not need to be kept"""
+    if not keepOrder:
+        wait(pending, return_when=FIRST_COMPLETED)
+        pending.rotate(-next(index for index, future in enumerate(pending) if future.done()))
+    return pending.popleft()
+
+def decoded_tables(config: dict[str, Any], families: set[int], workers: int, batchSize: int) -> Iterator[RouteTable]:
+    """Yield the route tables of the configured dump, decoded in this process or, for an uncompressed dump, across worker processes"""
+    mrtConfig = config["mrt"]
+    reader = MRTReader(path=mrtConfig["file"], peer=mrtConfig.get("peer"))
+    if workers == 1 or reader.compression():
+        yield from route_tables(reader, reader.routes(), families=families, batchSize=batchSize)
+        return
+
+    reader.read_peers()
+    chunks = reader.chunks(chunkSize=CHUNK_SIZE)
+    # Only a bounded number of chunks is kept in flight. In order, chunks are handed on in file order (so prefixes keep the
+    # order of the dump), otherwise as soon as any of them is decoded
+    keepOrder = mrtConfig.get("keepOrder", True)
+    # As for generated routes, the workers must not be forked from a process already running the writer threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("forkserver")) as executor:
+        pending = deque()
+        for start, stop in chunks:
+            pending.append(executor.submit(read_chunk, reader.path, mrtConfig.get("peer"), reader.peers, families, start, stop, batchSize))
+            if len(pending) >= 2 * workers:
+                yield from next_finished(pending, keepOrder).result()
+        while pending:
+            yield from next_finished(pending, keepOrder).result()
+
+def cached_tables(config: dict[str, Any], families: set[int], workers: int, batchSize: int) -> Iterator[RouteTable]:
+    """Yield the route tables of the configured dump from the MRT cache, decoding the dump (and caching it) if it is not cached yet"""
+    mrtConfig = config["mrt"]
+    cache = MRTCache.from_config(mrtConfig)
+    if not cache:
+        yield from decoded_tables(config=config, families=families, workers=workers, batchSize=batchSize)
+        return
+
+    try:
+        key = cache.key(dumpPath=mrtConfig["file"], peer=mrtConfig.get("peer"))
+    except OSError as e:
+        raise MRTFormatError(path=mrtConfig["file"], reason=e.strerror or str(e)) from e
+    cached = cache.load(key)
+    if cached:
+        # IPv4 is handed on before IPv6, as for generated routes
+        tables, _ = cached
+        for version in sorted(families & tables.keys()):
+            yield from batches(table=tables[version], batchSize=batchSize)
+        return
+
+    # Every family is decoded and cached, so the entry serves any addressFamily setting later on
+    decoded = {4: [], 6: []}
+    for table in decoded_tables(config=config, families={4, 6}, workers=workers, batchSize=batchSize):
+        decoded[table.version].append(table)
+        if table.version in families:
+            yield table
+    reader = MRTReader(path=mrtConfig["file"])
+    reader.read_peers()
+    cache.store(key=key, tables=decoded, peers=reader.peers)
+
+def readMRTBatches(config: dict[str, Any], workers: int = 1, batchSize: int = 8192) -> Iterator[RouteTable]:
+    """Yield the routes of the configured MRT RIB dump in batches of one IP version, keeping only the enabled families and the routes the policy constraints accept"""
+    families = {"ipv4": {4}, "ipv6": {6}, "ipv4_ipv6": {4, 6}}[config["basic"]["addressFamily"]]
+    policy = config.get("policy", {}).get("constraints", {})
+    shared = [constraint for constraint in (ASPathConstraint.from_config(policy.get("bgp_aspath")), CommunityConstraint.from_config(policy.get("bgp_communities"))) if constraint]
+    constraints = {version: [constraint for constraint in [PrefixConstraint.from_config(policy.get("prefix"), version=version)] if constraint] + shared for version in (4, 6)}
+
+    for table in cached_tables(config=config, families=families, workers=workers, batchSize=batchSize):
+        mask = constraint_mask(table, constraints[table.version])
+        if mask.any():
+            yield table if mask.all() else table.select(np.flatnonzero(mask))
@@ -0,0 +1,104 @@
+"""Contains the on-disk cache of decoded MRT dumps, stored as memory-mappable columns so repeated runs skip decoding"""
+from hashlib import sha256
+from ipaddress import ip_address
+from os import environ, getpid, makedirs, path, replace, scandir, utime
+from shutil import rmtree
+from typing import Any
+import numpy as np
+from src.objects import RouteTable
+
+# Bumped whenever the layout of a cache entry changes, so entries written by other versions are never read
+CACHE_FORMAT = 1
+HASH_CHUNK_SIZE = 16 << 20
+DEFAULT_CACHE_SIZE = 4096
+COLUMNS = [
+    "network", "prefixLength", "origin", "aspathOffset", "aspathLength", "asnPool", "communityOffset", "communityLength", "communityPool",
+    "largeCommunityOffset", "largeCommunityLength", "largeCommunityPool"
+]
+POOLS = {"aspathOffset": "asnPool", "communityOffset": "communityPool", "largeCommunityOffset": "largeCommunityPool"}
+
+def concatenate_tables(tables: list[RouteTable]) -> RouteTable:
+    """Join route tables of one IP version into a single table, appending their pools and shifting their offsets to match"""
+    columns = {name: np.concatenate([getattr(table, name) for table in tables]) for name in COLUMNS if name not in POOLS.values()}
+    for offsetName, poolName in POOLS.items():
+        bases = np.cumsum([0] + [len(getattr(table, poolName)) for table in tables[:-1]], dtype=np.uint64)
+        columns[offsetName] = np.concatenate([getattr(table, offsetName).astype(np.uint64) + base for table, base in zip(tables, bases)]).astype(np.uint32)
+        columns[poolName] = np.concatenate([getattr(table, poolName) for table in tables])
+    return RouteTable(**columns)
+
+class MRTCache:
+    """Directory of decoded MRT dumps, one entry per dump content, size and peer, evicted least recently used first once it outgrows its size"""
+    def __init__(self, directory: str, maxBytes: int):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    @classmethod
+    def from_config(cls, mrtConfig: dict[str, Any]) -> "MRTCache | None":
+        """Open the cache in the user's cache directory, unless mrt.cache disables it"""
+        if not mrtConfig.get("cache", True):
+            return None
+        base = environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+        return cls(directory=path.join(base, "jargen", "mrt"), maxBytes=int(mrtConfig.get("cacheSize", DEFAULT_CACHE_SIZE)) << 20)
+
+    @staticmethod
+    def key(dumpPath: str, peer: str | None) -> str:
+        """Hash the content and size of the dump, together with the peer whose routes are read from it"""
+        digest = sha256(f"{CACHE_FORMAT}:{path.getsize(dumpPath)}:{ip_address(peer) if peer else ''}:".encode("utf-8"))
+        with open(dumpPath, "rb") as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load(self, key: str) -> tuple[dict[int, RouteTable], list[tuple[str, int]]] | None:
+        """Map the tables (by IP version) and the peer table of a cached dump into memory, or return None if it is not cached"""
+        entry = path.join(self.directory, key)
+        if not path.isdir(entry):
+            return None
+        # Loading marks the entry as recently used
+        utime(entry)
+        tables = {}
+        for version in (4, 6):
+            if path.exists(path.join(entry, f"{version}.network.npy")):
+                tables[version] = RouteTable(**{name: np.load(path.join(entry, f"{version}.{name}.npy"), mmap_mode="r") for name in COLUMNS})
+        peers = list(zip(np.load(path.join(entry, "peerAddress.npy")).tolist(), np.load(path.join(entry, "peerAsn.npy")).tolist()))
+        return tables, peers
+
+    def store(self, key: str, tables: dict[int, list[RouteTable]], peers: list[tuple[Any, int]]):
+        """Write the decoded tables of a dump as a new entry, then evict the least recently used entries beyond the size of the cache"""
+        entry = path.join(self.directory, key)
+        # The entry is written under a temporary name and renamed into place, so a half-written entry is never loaded
+        staging = f"{entry}.{getpid()}.tmp"
+        try:
+            for version, versionTables in tables.items():
+                if versionTables:
+                    table = concatenate_tables(versionTables)
+                    for name in COLUMNS:
+                        self.save(staging, f"{version}.{name}.npy", getattr(table, name))
+            self.save(staging, "peerAddress.npy", np.array([str(address) for address, _ in peers], dtype=np.str_))
+            self.save(staging, "peerAsn.npy", np.array([asn for _, asn in peers], dtype=np.uint32))
+            replace(staging, entry)
+        except OSError:
+            # Caching is best effort, a dump that cannot be cached is simply decoded again next time
+            rmtree(staging, ignore_errors=True)
+            return
+        self.evict(keep=key)
+
+    @staticmethod
+    def save(directory: str, name: str, array: np.ndarray):
+        """Write one column of an entry as a .npy file, creating the entry's directory as needed"""
+        makedirs(directory, exist_ok=True)
+        np.save(path.join(directory, name), array)
+
+    def evict(self, keep: str):
+        """Remove the least recently used entries until the cache fits its size, always keeping the given entry"""
+        entries = []
+        for entry in scandir(self.directory):
+            if entry.is_dir() and not entry.name.endswith(".tmp"):
+                entries.append((entry.stat().st_mtime, sum(item.stat().st_size for item in scandir(entry.path)), entry.name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if name != keep:
+                rmtree(path.join(self.directory, name), ignore_errors=True)
+                total -= size
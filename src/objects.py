@@ -1,22 +1,174 @@
 """Contains all custom classes used throughout the jargen package"""
-from ipaddress import IPv4Network
+from ipaddress import IPv4Network, IPv6Network
+from typing import Iterator
+import numpy as np
 
-class Route:
-    """Object representing a route generated by jargen"""
-    def __init__(self, network: IPv4Network, aspath: list[str] = [], origin: str = "igp", communities: list[str] = []):
-        self.network = network
-        self.aspath = aspath
-        self.origin = origin
-        self.communities = communities
+# BGP origin codes, indexed by the uint8 origin column of a RouteTable
+ORIGIN_CODES = ["igp", "egp", "incomplete"]
 
-class Neighbor:
+def format_community(community: int) -> str:
+    """Format a packed 32-bit standard community as ASN:value"""
+    return f"{community >> 16}:{community & 0xFFFF}"
+
+def format_large_community(community: tuple[int, int, int]) -> str:
+    """Format a large community as global administrator:local data 1:local data 2"""
+    return ":".join(map(str, community))
+
+class Immutable:
+    """Base class for slotted, immutable objects that are hashed and compared by the values of their slots"""
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"{type(self).__name__} objects are immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} objects are immutable")
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __hash__(self) -> int:
+        return hash(self.values())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)})"
+
+class Route(Immutable):
+    """Object representing a route generated by jargen, with the AS path (ASNs), communities (packed integers) and large communities (triples) as tuples"""
+    __slots__ = ("network", "aspath", "origin", "communities", "largeCommunities")
+
+    def __init__(self, network: IPv4Network | IPv6Network, aspath: tuple[int, ...] = (), origin: str = "igp", communities: tuple[int, ...] = (),
+                 largeCommunities: tuple[tuple[int, int, int], ...] = ()):
+        # tuple() returns a tuple argument itself, but the large communities are only rebuilt when needed so interned tuples stay shared
+        if not (isinstance(largeCommunities, tuple) and all(isinstance(community, tuple) for community in largeCommunities)):
+            largeCommunities = tuple(map(tuple, largeCommunities))
+        super().__init__(network=network, aspath=tuple(aspath), origin=origin, communities=tuple(communities),
+                         largeCommunities=largeCommunities)
+
+class Neighbor(Immutable):
     """Object representing a BGP neighbor to be used in configuration generation"""
+    __slots__ = ("address", "asn")
+
     def __init__(self, address: str, asn: int):
-        self.address = address
-        self.asn = asn
+        super().__init__(address=address, asn=asn)
 
-class Attribute:
+class Attribute(Immutable):
     """Object representing a custom key:value attribute to be used in configuration generation"""
+    __slots__ = ("name", "value")
+
     def __init__(self, name: str, value: str):
-        self.name = name
-        self.value = value
\ No newline at end of file
+        super().__init__(name=name, value=value)
+
+class RouteTable:
+    """Columnar, array-backed table of routes, where AS paths and communities are offset/length pairs into shared pools"""
+    # IPv4 network addresses are a uint32 column, IPv6 network addresses a column of (upper, lower) uint64 pairs
+    def __init__(self, network: np.ndarray, prefixLength: np.ndarray, origin: np.ndarray,
+                 aspathOffset: np.ndarray, aspathLength: np.ndarray, asnPool: np.ndarray,
+                 communityOffset: np.ndarray | None = None, communityLength: np.ndarray | None = None, communityPool: np.ndarray | None = None,
+                 largeCommunityOffset: np.ndarray | None = None, largeCommunityLength: np.ndarray | None = None, largeCommunityPool: np.ndarray | None = None):
+        self.network = network.astype(np.uint32 if network.ndim == 1 else np.uint64, copy=False)
+        self.prefixLength = prefixLength.astype(np.uint8, copy=False)
+        self.origin = origin.astype(np.uint8, copy=False)
+        self.aspathOffset = aspathOffset.astype(np.uint32, copy=False)
+        self.aspathLength = aspathLength.astype(np.uint8, copy=False)
+        self.asnPool = asnPool.astype(np.uint32, copy=False)
+        self.communityOffset = np.zeros(len(network), dtype=np.uint32) if communityOffset is None else communityOffset.astype(np.uint32, copy=False)
+        self.communityLength = np.zeros(len(network), dtype=np.uint8) if communityLength is None else communityLength.astype(np.uint8, copy=False)
+        self.communityPool = np.empty(0, dtype=np.uint32) if communityPool is None else communityPool.astype(np.uint32, copy=False)
+        # Large communities are rows of (global administrator, local data 1, local data 2)
+        self.largeCommunityOffset = np.zeros(len(network), dtype=np.uint32) if largeCommunityOffset is None else largeCommunityOffset.astype(np.uint32, copy=False)
+        self.largeCommunityLength = np.zeros(len(network), dtype=np.uint8) if largeCommunityLength is None else largeCommunityLength.astype(np.uint8, copy=False)
+        self.largeCommunityPool = np.empty((0, 3), dtype=np.uint32) if largeCommunityPool is None else largeCommunityPool.astype(np.uint32, copy=False)
+
+    @staticmethod
+    def offsets(lengths: np.ndarray) -> np.ndarray:
+        """Turn per-route lengths into the offsets of consecutive runs in a pool"""
+        return (np.cumsum(lengths, dtype=np.uint64) - lengths).astype(np.uint32)
+
+    def __len__(self) -> int:
+        return len(self.network)
+
+    @property
+    def version(self) -> int:
+        """IP version of the networks in the table"""
+        return 4 if self.network.ndim == 1 else 6
+
+    @property
+    def networkType(self) -> type[IPv4Network] | type[IPv6Network]:
+        """Class of the network objects built for the routes of the table"""
+        return IPv4Network if self.version == 4 else IPv6Network
+
+    def networks(self) -> list[int]:
+        """Return the network addresses of the table as Python integers"""
+        if self.version == 4:
+            return self.network.tolist()
+        return [(upper << 64) | lower for upper, lower in self.network.tolist()]
+
+    def slice(self, start: int, stop: int) -> "RouteTable":
+        """Return the routes [start, stop) as a new table that shares this table's pools"""
+        return RouteTable(
+            network=self.network[start:stop], prefixLength=self.prefixLength[start:stop], origin=self.origin[start:stop],
+            aspathOffset=self.aspathOffset[start:stop], aspathLength=self.aspathLength[start:stop], asnPool=self.asnPool,
+            communityOffset=self.communityOffset[start:stop], communityLength=self.communityLength[start:stop], communityPool=self.communityPool,
+            largeCommunityOffset=self.largeCommunityOffset[start:stop], largeCommunityLength=self.largeCommunityLength[start:stop], largeCommunityPool=self.largeCommunityPool
+        )
+
+    def select(self, rows: np.ndarray) -> "RouteTable":
+        """Return the routes at the given row indices as a new table that shares this table's pools"""
+        return RouteTable(
+            network=self.network[rows], prefixLength=self.prefixLength[rows], origin=self.origin[rows],
+            aspathOffset=self.aspathOffset[rows], aspathLength=self.aspathLength[rows], asnPool=self.asnPool,
+            communityOffset=self.communityOffset[rows], communityLength=self.communityLength[rows], communityPool=self.communityPool,
+            largeCommunityOffset=self.largeCommunityOffset[rows], largeCommunityLength=self.largeCommunityLength[rows], largeCommunityPool=self.largeCommunityPool
+        )
+
+    def __getitem__(self, index: int) -> Route:
+        aspathOffset, communityOffset, largeCommunityOffset = int(self.aspathOffset[index]), int(self.communityOffset[index]), int(self.largeCommunityOffset[index])
+        address = self.network[index].tolist()
+        return Route(
+            network=self.networkType((address if self.version == 4 else (address[0] << 64) | address[1], int(self.prefixLength[index]))),
+            aspath=self.asnPool[aspathOffset:aspathOffset + self.aspathLength[index]].tolist(),
+            origin=ORIGIN_CODES[self.origin[index]],
+            communities=self.communityPool[communityOffset:communityOffset + self.communityLength[index]].tolist(),
+            largeCommunities=self.largeCommunityPool[largeCommunityOffset:largeCommunityOffset + self.largeCommunityLength[index]].tolist()
+        )
+
+    @staticmethod
+    def window(pool: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> tuple[list[int], int]:
+        """Return the part of a pool referenced by the rows as a list, along with the pool offset it starts at"""
+        if not len(offsets):
+            return [], 0
+        start, stop = int(offsets.min()), int((offsets.astype(np.uint64) + lengths).max())
+        return pool[start:stop].tolist(), start
+
+    def __iter__(self) -> Iterator[Route]:
+        """Lazily build a Route view of every row, converting the referenced parts of the pools to Python values only once"""
+        asnPool, asnBase = self.window(self.asnPool, self.aspathOffset, self.aspathLength)
+        communityPool, communityBase = self.window(self.communityPool, self.communityOffset, self.communityLength)
+        largeCommunityPool, largeCommunityBase = self.window(self.largeCommunityPool, self.largeCommunityOffset, self.largeCommunityLength)
+        largeCommunityPool = list(map(tuple, largeCommunityPool))
+        # Intern the attribute tuples, so that routes with equal attributes share (and compare by identity against) one tuple
+        interned = {}
+        networkType = self.networkType
+        for network, prefixLength, origin, aspathOffset, aspathLength, communityOffset, communityLength, largeCommunityOffset, largeCommunityLength in zip(
+            self.networks(), self.prefixLength.tolist(), self.origin.tolist(), (self.aspathOffset - asnBase).tolist(),
+            self.aspathLength.tolist(), (self.communityOffset - communityBase).tolist(), self.communityLength.tolist(),
+            (self.largeCommunityOffset - largeCommunityBase).tolist(), self.largeCommunityLength.tolist()
+        ):
+            aspath = tuple(asnPool[aspathOffset:aspathOffset + aspathLength])
+            communities = tuple(communityPool[communityOffset:communityOffset + communityLength])
+            largeCommunities = tuple(largeCommunityPool[largeCommunityOffset:largeCommunityOffset + largeCommunityLength])
+            yield Route(
+                network=networkType((network, prefixLength)),
+                aspath=interned.setdefault(aspath, aspath),
+                origin=ORIGIN_CODES[origin],
+                communities=interned.setdefault(communities, communities),
+                largeCommunities=interned.setdefault(largeCommunities, largeCommunities)
+            )
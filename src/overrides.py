@@ -0,0 +1,108 @@
+"""Contains the policy.overrides of the configuration, compiled into longest-match tries that assign routes to overrides in whole batches"""
+from ipaddress import ip_network
+from typing import Any, Callable
+import numpy as np
+
+def merge_config(base: dict[str, Any], override: dict[str, Any]) -> dict[str, Any]:
+    """Return a copy of the configuration with the override's sections merged over it, replacing lists and values and merging dictionaries"""
+    merged = dict(base)
+    for key, value in override.items():
+        merged[key] = merge_config(base[key], value) if isinstance(value, dict) and isinstance(base.get(key), dict) else value
+    return merged
+
+class PrefixTrie:
+    """Binary trie over network addresses, stored as flat arrays so a whole batch of routes can walk it at once"""
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.children = [[-1, -1]]
+        # Index of the override whose match (or except) list holds the prefix ending at every node, or -1
+        self.match = [-1]
+        self.strict = [False]
+        self.excepted = [-1]
+
+    def node(self, address: int, prefixLength: int) -> int:
+        """Return the node of a prefix, creating the nodes on its path as needed"""
+        node = 0
+        for depth in range(prefixLength):
+            bit = (address >> (self.bits - 1 - depth)) & 1
+            if self.children[node][bit] < 0:
+                self.children[node][bit] = len(self.children)
+                self.children.append([-1, -1])
+                self.match.append(-1)
+                self.strict.append(False)
+                self.excepted.append(-1)
+            node = self.children[node][bit]
+        return node
+
+    def add_match(self, address: int, prefixLength: int, override: int, strict: bool):
+        node = self.node(address, prefixLength)
+        self.match[node], self.strict[node] = override, strict
+
+    def add_except(self, address: int, prefixLength: int, override: int):
+        self.excepted[self.node(address, prefixLength)] = override
+
+    def compile(self):
+        """Freeze the trie into NumPy arrays"""
+        self.children = np.array(self.children, dtype=np.int64)
+        self.match = np.array(self.match, dtype=np.int64)
+        self.strict = np.array(self.strict, dtype=bool)
+        self.excepted = np.array(self.excepted, dtype=np.int64)
+
+    def lookup(self, addresses: np.ndarray, prefixLengths: np.ndarray) -> np.ndarray:
+        """Walk the trie for every network at once, returning the index of the longest matching override (or -1) of each"""
+        prefixLengths = prefixLengths.astype(np.int64)
+        node = np.zeros(len(addresses), dtype=np.int64)
+        active = np.ones(len(addresses), dtype=bool)
+        # The override matched at every depth of the walk (or -1), so that an except can fall back to the next shorter match
+        matches = np.full((len(addresses), self.bits + 1), -1, dtype=np.int64)
+        for depth in range(self.bits + 1):
+            # A strict prefix only matches a network of exactly its own length, any other prefix also matches more specific networks
+            match = self.match[node]
+            matches[:, depth] = np.where(active & (match >= 0) & (~self.strict[node] | (prefixLengths == depth)), match, -1)
+            # An except prefix releases the networks inside it from the override it belongs to, and from no other override
+            excepted = np.where(active, self.excepted[node], -1)
+            matches[:, :depth + 1][(matches[:, :depth + 1] == excepted[:, None]) & (excepted[:, None] >= 0)] = -1
+            if depth == self.bits:
+                break
+            child = self.children[node, ((addresses >> np.uint64(self.bits - 1 - depth)) & np.uint64(1)).astype(np.int64)]
+            active &= (depth < prefixLengths) & (child >= 0)
+            if not active.any():
+                break
+            node = np.where(active, child, 0)
+        # The longest match still standing wins
+        matched = matches >= 0
+        deepest = self.bits - np.argmax(matched[:, ::-1], axis=1)
+        return np.where(matched.any(axis=1), matches[np.arange(len(addresses)), deepest], -1)
+
+class Overrides:
+    """The policy.overrides of the configuration, each with its merged configuration and samplers, and one trie per address family"""
+    def __init__(self, config: dict[str, Any], samplerFactory: Callable[[dict[str, Any]], dict]):
+        overrides = config.get("policy", {}).get("overrides") or []
+        # The prefixes section only shapes the networks, which are generated before overrides are applied
+        self.configs = [merge_config(config, {key: value for key, value in (override.get("attributes") or {}).items() if key != "prefixes"}) for override in overrides]
+        self.samplers = [samplerFactory(overrideConfig) for overrideConfig in self.configs]
+        self.tries = {4: PrefixTrie(bits=32), 6: PrefixTrie(bits=64)}
+        for index, override in enumerate(overrides):
+            for prefix in override.get("match") or []:
+                network = ip_network(prefix)
+                trie, shift = self.trie(network.version)
+                trie.add_match(int(network.network_address) >> shift, min(network.prefixlen, trie.bits), index, strict=bool(override.get("strict", False)))
+            for prefix in override.get("except") or []:
+                network = ip_network(prefix)
+                trie, shift = self.trie(network.version)
+                trie.add_except(int(network.network_address) >> shift, min(network.prefixlen, trie.bits), index)
+        for trie in self.tries.values():
+            trie.compile()
+
+    def __len__(self) -> int:
+        return len(self.configs)
+
+    def trie(self, version: int) -> tuple[PrefixTrie, int]:
+        """Return the trie of an IP version and the shift that brings its addresses down to the trie's width (the upper 64 bits of IPv6)"""
+        return self.tries[version], 0 if version == 4 else 64
+
+    def lookup(self, network: np.ndarray, prefixLength: np.ndarray) -> np.ndarray:
+        """Return the index of the override that applies to every network (a RouteTable network column), or -1 for networks without one"""
+        if network.ndim == 1:
+            return self.tries[4].lookup(network.astype(np.uint64), prefixLength)
+        return self.tries[6].lookup(network[:, 0], prefixLength)
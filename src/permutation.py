@@ -0,0 +1,49 @@
+"""Contains the keyed pseudo-random permutation used to sample prefixes without replacement"""
+import numpy as np
+
+def splitmix64(value: int) -> int:
+    """Scramble a 64-bit integer (used to derive independent round keys from a single key)"""
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+class FeistelPermutation:
+    """Keyed bijection of the integers [0, size), computed with a balanced Feistel network and cycle-walking"""
+    rounds = 6
+
+    def __init__(self, size: int, key: int):
+        self.size = size
+        # The network permutes the smallest even-width power of two covering the size, which is under four times the size
+        bits = max(size - 1, 1).bit_length()
+        self.halfBits = np.uint64((bits + 1) // 2)
+        self.halfMask = np.uint64((1 << int(self.halfBits)) - 1)
+        self.roundKeys = []
+        for _ in range(self.rounds):
+            key = splitmix64(key)
+            self.roundKeys.append(np.uint64(key))
+
+    def round(self, half: np.ndarray, roundKey: np.uint64) -> np.ndarray:
+        """Feistel round function, mixing one half of the block with the round key"""
+        value = (half ^ roundKey) * np.uint64(0xBF58476D1CE4E5B9)
+        value ^= value >> np.uint64(31)
+        value *= np.uint64(0x94D049BB133111EB)
+        value ^= value >> np.uint64(29)
+        return value & self.halfMask
+
+    def encrypt(self, values: np.ndarray) -> np.ndarray:
+        """Apply the Feistel network once over the full power-of-two domain"""
+        left, right = values >> self.halfBits, values & self.halfMask
+        for roundKey in self.roundKeys:
+            left, right = right, left ^ self.round(right, roundKey)
+        return (left << self.halfBits) | right
+
+    def permute(self, indices: np.ndarray) -> np.ndarray:
+        """Map every index in [0, size) to its position in the permutation, without repeats and without any seen-set"""
+        values = self.encrypt(indices.astype(np.uint64))
+        # Cycle-walk values that land outside [0, size) until they fall back inside, which keeps the mapping a bijection
+        pending = np.flatnonzero(values >= np.uint64(self.size))
+        while len(pending):
+            values[pending] = self.encrypt(values[pending])
+            pending = pending[values[pending] >= np.uint64(self.size)]
+        return values
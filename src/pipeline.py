@@ -0,0 +1,55 @@
+"""Contains the streaming pipeline that hands generated route batches to the platform writers through bounded queues"""
+from contextlib import suppress
+from queue import Queue
+from threading import Thread
+from typing import Callable, Iterable, Iterator
+from src.exceptions import PipelineAbortedError
+from src.objects import RouteTable
+
+# Sent in place of the end-of-stream marker (None) when the producer fails, so no writer mistakes a partial table for a complete one
+ABORT = object()
+
+def drain(queue: Queue) -> Iterator[RouteTable]:
+    """Yield route batches from the queue until the end-of-stream marker (None) arrives, raising PipelineAbortedError if the producer failed"""
+    while (batch := queue.get()) is not None:
+        if batch is ABORT:
+            raise PipelineAbortedError()
+        yield batch
+
+def runPipeline(batches: Iterable[RouteTable], writers: list[Callable[[Iterable[RouteTable]], None]], maxBatches: int = 4) -> None:
+    """Feed every route batch to all writers as it is generated, holding at most maxBatches batches per writer in memory"""
+    queues = [Queue(maxsize=maxBatches) for _ in writers]
+    errors = []
+
+    def consume(writer: Callable[[Iterable[RouteTable]], None], queue: Queue) -> None:
+        stream = drain(queue)
+        try:
+            writer(stream)
+        except PipelineAbortedError:
+            # The producer's own error is raised instead
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # Keep draining if the writer stopped early, so that the generator never blocks on a full queue
+            with suppress(PipelineAbortedError):
+                for _ in stream:
+                    pass
+
+    threads = [Thread(target=consume, args=(writer, queue)) for writer, queue in zip(writers, queues)]
+    for thread in threads:
+        thread.start()
+    finished = False
+    try:
+        for batch in batches:
+            for queue in queues:
+                queue.put(batch)
+        finished = True
+    finally:
+        for queue in queues:
+            queue.put(None if finished else ABORT)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
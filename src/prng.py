@@ -0,0 +1,47 @@
+"""Contains the counter-based random number generator that makes route generation reproducible for a given prefixes.routeSeed"""
+from hashlib import sha256
+from secrets import randbits
+import numpy as np
+
+MASK32 = np.uint64(0xFFFFFFFF)
+
+class CounterRNG:
+    """Philox4x32-10 counter-based generator, where every output is a pure function of (seed, stream, counter)"""
+    rounds = 10
+    multipliers = (np.uint64(0xD2511F53), np.uint64(0xCD9E8D57))
+    weyl = (0x9E3779B9, 0xBB67AE85)
+
+    def __init__(self, seed: int):
+        self.seed = seed & 0xFFFFFFFFFFFFFFFF
+
+    @classmethod
+    def from_route_seed(cls, routeSeed: str | None) -> "CounterRNG":
+        """Key the generator with the configured route seed, or with a fresh random seed if none is configured"""
+        if routeSeed is None or str(routeSeed) == "":
+            return cls(seed=randbits(64))
+        return cls(seed=int.from_bytes(sha256(str(routeSeed).encode("utf-8")).digest()[:8], "little"))
+
+    def bits(self, stream: int, counters: np.ndarray) -> np.ndarray:
+        """Return 64 random bits for every counter in the array, drawn from the given independent stream"""
+        counters = np.asarray(counters, dtype=np.uint64)
+        x0, x1 = counters & MASK32, counters >> np.uint64(32)
+        x2, x3 = np.full_like(counters, stream & 0xFFFFFFFF), np.full_like(counters, stream >> 32)
+        k0, k1 = self.seed & 0xFFFFFFFF, self.seed >> 32
+        for _ in range(self.rounds):
+            product0, product1 = self.multipliers[0] * x0, self.multipliers[1] * x2
+            x0, x1, x2, x3 = (
+                (product1 >> np.uint64(32)) ^ x1 ^ np.uint64(k0),
+                product1 & MASK32,
+                (product0 >> np.uint64(32)) ^ x3 ^ np.uint64(k1),
+                product0 & MASK32
+            )
+            k0, k1 = (k0 + self.weyl[0]) & 0xFFFFFFFF, (k1 + self.weyl[1]) & 0xFFFFFFFF
+        return (x0 << np.uint64(32)) | x1
+
+    def key(self, stream: int, counter: int = 0) -> int:
+        """Return a single 64-bit value, e.g. to key a permutation or seed a helper generator"""
+        return int(self.bits(stream, np.array([counter]))[0])
+
+    def uniform(self, stream: int, counters: np.ndarray) -> np.ndarray:
+        """Return a float in [0, 1) for every counter in the array"""
+        return (self.bits(stream, counters) >> np.uint64(11)) * (1.0 / 2**53)
@@ -0,0 +1,38 @@
+"""Contains the alias-method sampler used for every probability-weighted list in the configuration"""
+from typing import Any
+import numpy as np
+
+class AliasSampler:
+    """Walker/Vose alias table over a weighted list of values, giving O(1) draws from a single uniform number each"""
+    def __init__(self, values: list[Any], weights: list[float]):
+        self.values = values
+        self.lookup = np.array(values)
+        count = len(values)
+        scaled = np.array(weights, dtype=np.float64) * count / sum(weights)
+        self.probability = np.ones(count, dtype=np.float64)
+        self.alias = np.arange(count, dtype=np.int64)
+
+        # Pair every under-full column with an over-full one that tops it up (Vose's method)
+        small = [index for index in range(count) if scaled[index] < 1]
+        large = [index for index in range(count) if scaled[index] >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+    @classmethod
+    def from_config(cls, options: list[dict[str, Any]]) -> "AliasSampler":
+        """Build a sampler from a list of value/probability pairs in the configuration"""
+        return cls(values=[option["value"] for option in options], weights=[option["probability"] for option in options])
+
+    def indices(self, uniforms: np.ndarray) -> np.ndarray:
+        """Draw the index of a value for every uniform number in [0, 1)"""
+        scaled = uniforms * len(self.values)
+        columns = np.minimum(scaled.astype(np.int64), len(self.values) - 1)
+        return np.where(scaled - columns < self.probability[columns], columns, self.alias[columns])
+
+    def sample(self, uniforms: np.ndarray) -> np.ndarray:
+        """Draw a value for every uniform number in [0, 1)"""
+        return self.lookup[self.indices(uniforms)]